@@ -1,27 +1,119 @@
 from csvquery import *
-import time, math
-from datetime import datetime
+import argparse, csv, json, os, platform, random, statistics, sys, tempfile, time, tracemalloc
+from datetime import date, timedelta
 
-today = "2020-03-23"
+# Synthetic data
+def generate_csv(filepath, rows, cardinality, seed=0):
+    generator = random.Random(seed)
+    first_day = date(2020, 1, 1)
+    with open(filepath, "w", newline="") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["id", "date", "category", "value", "amount"])
+        for i in range(rows):
+            csv_writer.writerow([
+                i,
+                (first_day + timedelta(days=generator.randrange(365))).isoformat(),
+                "category_" + str(generator.randrange(cardinality)),
+                generator.randrange(1000000),
+                round(generator.uniform(0, 1000), 2)
+            ])
+
+def generate_categories(cardinality):
+    categories = parse_csv("category,label")
+    categories.data = [["category_" + str(i), "label_" + str(i)] for i in range(cardinality)]
+    return categories
 
 # Benchmarking
-def benchmark(func, start_func=lambda:0, times=5, digits=3):
-    start = time.time()
-    start_func()
-    for _ in range(times):
-        func()
-    elapsed = round(time.time() - start, digits)
-    print("elapsed time: "+str(elapsed).ljust(digits + 2, "0"))
-
-def binary_vs_sequential(times = 5000):
-    dataset = open_csv("data/coronavirus_data.csv").query({"date":today})
-
-    print("\nWITHOUT INDEXING:")
-    benchmark(lambda: dataset.query({"total_cases":{"gt":100, "comparison":Comparisons.integers}}), lambda: 0, times)
-    print("\nWITH INDEXING:")
-    benchmark(lambda: dataset.query({"total_cases":{"gt":100}}), lambda: dataset.index("total_cases", Comparisons.integers), times)
-    print()
-
-    dataset.index("total_cases")
-
-binary_vs_sequential()
+def benchmark(name, func, setup=lambda: None, rows=0, repeat=5, warmup=1):
+    for _ in range(warmup):
+        func(setup())
+
+    times = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        func(argument)
+        times.append(time.perf_counter() - start)
+
+    # memory is measured in a separate run since tracing slows everything down
+    argument = setup()
+    tracemalloc.start()
+    func(argument)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    median = statistics.median(times)
+    return {
+        "name": name,
+        "rows": rows,
+        "repeat": repeat,
+        "min_seconds": min(times),
+        "median_seconds": median,
+        "mean_seconds": statistics.mean(times),
+        "rows_per_second": rows / median if median > 0 else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+def run_benchmarks(filepath, rows, cardinality, repeat, warmup, only=None):
+    schema = {"value": Comparisons.integers, "amount": Comparisons.floats}
+    dataset = open_csv(filepath, schema=schema)
+    indexed = open_csv(filepath, schema=schema).index("value", Comparisons.integers)
+    encoded = open_csv(filepath, schema=schema).encode(["category"])
+    categories = generate_categories(cardinality)
+    middle = 500000
+
+    cases = [
+        ("open_csv", lambda _: open_csv(filepath), lambda: None),
+        ("open_csv_mapped", lambda _: open_csv(filepath, mapped=True), lambda: None),
+        ("index", lambda d: d.index("value", Comparisons.integers), lambda: dataset.select()),
+        ("query_unindexed", lambda _: dataset.query({"value": {"gte": middle, "lt": middle + 10000}}), lambda: None),
+        ("query_indexed", lambda _: indexed.query({"value": {"gte": middle, "lt": middle + 10000}}), lambda: None),
+        ("query_equal", lambda _: dataset.query({"category": "category_1"}), lambda: None),
+        ("query_encoded", lambda _: encoded.query({"category": "category_1"}), lambda: None),
+        ("encode", lambda d: d.encode(["category"]), lambda: dataset.select()),
+        ("select", lambda _: dataset.select(["id", "category"]), lambda: None),
+        ("join", lambda d: d.join(categories, ["category", "category"]), lambda: dataset.select()),
+        ("select_unique", lambda _: dataset.select_unique("category"), lambda: None),
+        ("select_unique_encoded", lambda _: encoded.select_unique("category"), lambda: None),
+        ("group_by", lambda _: dataset.group_by("category").aggregate({"rows": "count", "total": {"sum": "amount"}, "largest": {"max": "value"}}), lambda: None),
+        ("sum", lambda _: dataset.sum("amount"), lambda: None),
+        ("average", lambda _: dataset.average("amount"), lambda: None),
+    ]
+
+    results = []
+    for name, func, setup in cases:
+        if only != None and not name in only:
+            continue
+        result = benchmark(name, func, setup, rows, repeat, warmup)
+        print(name.ljust(22) + ("%.4f s" % result["median_seconds"]).rjust(12) + ("%.0f rows/s" % (result["rows_per_second"] or 0)).rjust(20) + ("%.1f MiB" % (result["peak_memory_bytes"] / 2**20)).rjust(12))
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks csvquery on a synthetic dataset.")
+    parser.add_argument("--rows", type=int, default=100000, help="number of rows to generate")
+    parser.add_argument("--cardinality", type=int, default=100, help="number of distinct categories")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before timing")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the generated data")
+    parser.add_argument("--only", nargs="+", help="names of the benchmarks to run")
+    parser.add_argument("--json", help="file to write the results to as JSON")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = os.path.join(directory, "synthetic.csv")
+        generate_csv(filepath, arguments.rows, arguments.cardinality, arguments.seed)
+        results = run_benchmarks(filepath, arguments.rows, arguments.cardinality, arguments.repeat, arguments.warmup, arguments.only)
+
+    if arguments.json != None:
+        with open(arguments.json, "w") as json_file:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "rows": arguments.rows,
+                "cardinality": arguments.cardinality,
+                "seed": arguments.seed,
+                "results": results,
+            }, json_file, indent=4)
+
+main()
@@ -21,5 +21,8 @@ setuptools.setup(
     install_requires=[
         'requests',
     ],
-    python_requires='>=3.4',
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    python_requires='>=3.7',
 )
\ No newline at end of file
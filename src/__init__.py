@@ -1,3 +1,3 @@
-from .csvquery import open_csv, get_csv, parse_csv, Operators, Comparisons
+from .csvquery import open_csv, scan_csv, follow_csv, open_partitioned, load_snapshot, get_csv, get_csvs_async, parse_csv, Operators, Comparisons, JoinModes, Engines, IndexTypes, Aggregations, Query, add_hook, remove_hook
 
-__all__ = ["open_csv", "get_csv", "parse_csv", "Operators", "Comparisons"]
\ No newline at end of file
+__all__ = ["open_csv", "scan_csv", "follow_csv", "open_partitioned", "load_snapshot", "get_csv", "get_csvs_async", "parse_csv", "Operators", "Comparisons", "JoinModes", "Engines", "IndexTypes", "Aggregations", "Query", "add_hook", "remove_hook"]
\ No newline at end of file
@@ -1,6 +1,12 @@
-import sys, math, types, csv, copy, concurrent.futures, requests
+import sys, os, io, ast, glob, math, mmap, time, json, zlib, gzip, codecs, hashlib, types, logging, csv, operator, functools, itertools, collections, bisect, heapq, asyncio, multiprocessing, threading, concurrent.futures, requests
+from array import array
 from datetime import datetime
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Operators:
     equal = "eq"
@@ -16,16 +22,103 @@ class Operators:
 
     comparison = "comparison"
 
+class Engines:
+    python = "python"
+    numpy = "numpy"
+
+class IndexTypes:
+    sorted = "sorted"
+    hash = "hash"
+
+class Aggregations:
+    count = "count"
+    sum = "sum"
+    average = "avg"
+    minimum = "min"
+    maximum = "max"
+    distinct_count = "distinct"
+
+class JoinModes:
+    inner = "inner"
+    left = "left"
+    outer = "outer"
+
+def key_comparison(key, typecode=None, spec=None):
+    comparison = lambda a, b: key(a) < key(b)
+    comparison.key = key
+    comparison.typecode = typecode
+    comparison.spec = spec
+    return comparison
+
+def comparison_key(comparison):
+    key = getattr(comparison, "key", None)
+    if key != None:
+        return key
+    return functools.cmp_to_key(lambda a, b: -1 if comparison(a, b) else (1 if comparison(b, a) else 0))
+
+def datetime_to_microseconds(date):
+    if date.utcoffset() != None:
+        date = date.replace(tzinfo=None) - date.utcoffset()
+    return (date.toordinal() * 86400 + date.hour * 3600 + date.minute * 60 + date.second) * 1000000 + date.microsecond
+
+date_comparisons = {}
+date_cache_size = 1 << 16
+
+# zero-padded ISO-8601 formats, which sort like the dates they represent and can be parsed without strptime
+iso_date_widths = {
+    "%Y-%m-%d"          :   10,
+    "%Y-%m-%d %H:%M"    :   16,
+    "%Y-%m-%dT%H:%M"    :   16,
+    "%Y-%m-%d %H:%M:%S" :   19,
+    "%Y-%m-%dT%H:%M:%S" :   19,
+}
+
+def get_date_key(format_string):
+    width = iso_date_widths.get(format_string)
+
+    # each distinct string is only parsed once, since date columns repeat the same values a lot
+    @functools.lru_cache(maxsize=date_cache_size)
+    def key(text):
+        if len(text) == width:
+            return datetime_to_microseconds(datetime.fromisoformat(text))
+        return datetime_to_microseconds(datetime.strptime(text, format_string))
+    return key
+
+def get_date_comparison(format_string):
+    key = get_date_key(format_string)
+    width = iso_date_widths.get(format_string)
+    if width == None:
+        return key_comparison(key, "q", ["date", format_string])
+
+    comparison = lambda a, b: a < b if len(a) == width and len(b) == width else key(a) < key(b)
+    comparison.key = key
+    comparison.typecode = "q"
+    comparison.spec = ["date", format_string]
+    return comparison
+
 class Comparisons:
-    integers = lambda a, b: int(a) < int(b)
-    floats = lambda a, b: float(a) < float(b)
-    strings = lambda a, b: a < b
+    integers = key_comparison(int, "q", "integers")
+    floats = key_comparison(float, "d", "floats")
+    strings = key_comparison(str, None, "strings")
 
     default = floats
     
     @staticmethod
-    def get_date_comparison(format_string):        
-        return lambda a, b: datetime.strptime(a, format_string) < datetime.strptime(b, format_string)
+    def get_key_comparison(key):
+        return key_comparison(key)
+
+    @staticmethod
+    def get_date_comparison(format_string):
+        if not format_string in date_comparisons:
+            date_comparisons[format_string] = get_date_comparison(format_string)
+        return date_comparisons[format_string]
+
+def get_comparison_from_spec(spec):
+    if spec in ("integers", "floats", "strings"):
+        return getattr(Comparisons, spec)
+    if type(spec) is list and len(spec) == 2 and spec[0] == "date":
+        return Comparisons.get_date_comparison(spec[1])
+    return None
        
 operator_functions = {
     Operators.equal                 :   lambda t, v, c: t == v,
@@ -40,6 +133,587 @@ operator_functions = {
     Operators._or                   :   lambda t, v, c: True in [operator_functions[list(d)[0]](t, d[list(d)[0]], c) for d in v],
 }
 
+index_low_operators = (Operators.equal, Operators.greater_than, Operators.greater_than_or_equal)
+index_high_operators = (Operators.equal, Operators.less_than, Operators.less_than_or_equal)
+native_comparison = operator.lt
+ordering_operators = (Operators.less_than, Operators.greater_than, Operators.less_than_or_equal, Operators.greater_than_or_equal)
+
+# a filter value that can't be converted into the type of the cells, which is never equal to any of them
+class Unconvertible:
+
+    def __init__(self, value):
+        self.value = value
+
+def get_converter(key):
+    def convert(value):
+        try:
+            return key(str(value))
+        except (ValueError, OverflowError):
+            return Unconvertible(value)
+    return convert
+
+def compile_ordering(test, value, never):
+    if type(value) is Unconvertible:
+        error_message(f"Query: \'{value.value}\' can't be converted into the type of its field, so it can't be compared, matching no rows")
+        return never
+    return test(value)
+
+def converted_values(values, convert):
+    return [value for value in map(convert, values) if type(value) is not Unconvertible]
+
+# k converts the filter value into the type of the cells being tested
+operator_compilers = {
+    Operators.equal                 :   lambda v, c, k: (lambda v: lambda t: t == v)(k(v)),
+    Operators.not_equal             :   lambda v, c, k: (lambda v: lambda t: t != v)(k(v)),
+    Operators.less_than             :   lambda v, c, k: compile_ordering(lambda v: lambda t: c(t, v), k(v), lambda t: False),
+    Operators.greater_than          :   lambda v, c, k: compile_ordering(lambda v: lambda t: c(v, t), k(v), lambda t: False),
+    Operators.less_than_or_equal    :   lambda v, c, k: compile_ordering(lambda v: lambda t: not c(v, t), k(v), lambda t: False),
+    Operators.greater_than_or_equal :   lambda v, c, k: compile_ordering(lambda v: lambda t: not c(t, v), k(v), lambda t: False),
+    Operators.inside                :   lambda v, c, k: frozenset(converted_values([str(x) for x in v], k)).__contains__,
+    Operators._not                  :   lambda v, c, k: negate_test(compile_nested_operation(v, c, k)),
+    Operators._and                  :   lambda v, c, k: all_tests([compile_nested_operation(d, c, k) for d in v]),
+    Operators._or                   :   lambda v, c, k: any_tests([compile_nested_operation(d, c, k) for d in v]),
+}
+
+def compile_operation(operator, value, comparison, convert=lambda v: v):
+    if not operator in operator_compilers:
+        error_message(f"Query: operator \'{operator}\' does not exist, skipping")
+        return lambda t: True
+    return operator_compilers[operator](value, comparison, convert)
+
+def compile_nested_operation(operation, comparison, convert):
+    operator = list(operation)[0]
+    return compile_operation(operator, operation[operator], comparison, convert)
+
+no_rows_mask = lambda c: numpy.zeros(len(c), dtype=bool)
+all_rows_mask = lambda c: numpy.ones(len(c), dtype=bool)
+
+operator_mask_compilers = {
+    Operators.equal                 :   lambda v, k: (lambda v: no_rows_mask if type(v) is Unconvertible else lambda c: c == v)(k(v)),
+    Operators.not_equal             :   lambda v, k: (lambda v: all_rows_mask if type(v) is Unconvertible else lambda c: c != v)(k(v)),
+    Operators.less_than             :   lambda v, k: compile_ordering(lambda v: lambda c: c < v, k(v), no_rows_mask),
+    Operators.greater_than          :   lambda v, k: compile_ordering(lambda v: lambda c: c > v, k(v), no_rows_mask),
+    Operators.less_than_or_equal    :   lambda v, k: compile_ordering(lambda v: lambda c: c <= v, k(v), no_rows_mask),
+    Operators.greater_than_or_equal :   lambda v, k: compile_ordering(lambda v: lambda c: c >= v, k(v), no_rows_mask),
+    Operators.inside                :   lambda v, k: (lambda v: lambda c: numpy.isin(c, v))(list(set(converted_values([str(x) for x in v], k)))),
+    Operators._not                  :   lambda v, k: negate_mask(compile_nested_mask(v, k)),
+    Operators._and                  :   lambda v, k: all_masks([compile_nested_mask(d, k) for d in v]),
+    Operators._or                   :   lambda v, k: any_masks([compile_nested_mask(d, k) for d in v]),
+}
+
+def compile_mask(operator, value, convert):
+    if not operator in operator_mask_compilers:
+        error_message(f"Query: operator \'{operator}\' does not exist, skipping")
+        return lambda c: numpy.ones(len(c), dtype=bool)
+    return operator_mask_compilers[operator](value, convert)
+
+def compile_nested_mask(operation, convert):
+    operator = list(operation)[0]
+    return compile_mask(operator, operation[operator], convert)
+
+def negate_mask(mask):
+    return lambda c: ~mask(c)
+
+def all_masks(masks):
+    if len(masks) == 0:
+        return lambda c: numpy.ones(len(c), dtype=bool)
+    if len(masks) == 1:
+        return masks[0]
+    def mask(c):
+        result = masks[0](c)
+        for single_mask in masks[1:]:
+            result &= single_mask(c)
+        return result
+    return mask
+
+def any_masks(masks):
+    if len(masks) == 0:
+        return lambda c: numpy.zeros(len(c), dtype=bool)
+    if len(masks) == 1:
+        return masks[0]
+    def mask(c):
+        result = masks[0](c)
+        for single_mask in masks[1:]:
+            result |= single_mask(c)
+        return result
+    return mask
+
+def uses_ordering(operations):
+    for operator, value in operations.items():
+        if operator in ordering_operators:
+            return True
+        if operator == Operators._not and type(value) is dict and uses_ordering(value):
+            return True
+        if operator in (Operators._and, Operators._or) and True in [uses_ordering(d) for d in value if type(d) is dict]:
+            return True
+    return False
+
+def negate_test(test):
+    return lambda t: not test(t)
+
+def all_tests(tests):
+    if len(tests) == 0:
+        return lambda t: True
+    if len(tests) == 1:
+        return tests[0]
+    def test(t):
+        for single_test in tests:
+            if not single_test(t):
+                return False
+        return True
+    return test
+
+def any_tests(tests):
+    if len(tests) == 0:
+        return lambda t: False
+    if len(tests) == 1:
+        return tests[0]
+    def test(t):
+        for single_test in tests:
+            if single_test(t):
+                return True
+        return False
+    return test
+
+derivation_batch_size = 4096
+
+def get_expression_fields(expression, fields):
+    names = []
+    for node in ast.walk(ast.parse(expression.strip(), mode="eval")):
+        if type(node) is ast.Name and node.id in fields and not node.id in names:
+            names.append(node.id)
+    return names
+
+# an expression like "cases / population" becomes "lambda cases, population: cases / population"
+def compile_expression(expression, fields):
+    names = get_expression_fields(expression, fields)
+    function = eval(compile(f"lambda {', '.join(names)}: ({expression.strip()})", "<expression>", "eval"), {"math": math, "datetime": datetime})
+    return function, names
+
+def derive_rows(fields, rows, derivation, columns=None, batch=False):
+    if type(derivation) is str:
+        derivation, columns = compile_expression(derivation, fields)
+    if columns == None:
+        for row in rows:
+            yield row, derivation(dict(zip(fields, row)))
+        return
+    field_ids = get_field_ids(fields, columns)
+    if batch:
+        rows = iter(rows)
+        chunk = list(itertools.islice(rows, derivation_batch_size))
+        while len(chunk) > 0:
+            yield from zip(chunk, derivation(*[[row[i] for row in chunk] for i in field_ids]))
+            chunk = list(itertools.islice(rows, derivation_batch_size))
+    elif len(field_ids) == 1:
+        field_id = field_ids[0]
+        for row in rows:
+            yield row, derivation(row[field_id])
+    else:
+        for row in rows:
+            yield row, derivation(*[row[i] for i in field_ids])
+
+def row_predicate(field_tests):
+    if len(field_tests) == 0:
+        return lambda row: True
+    if len(field_tests) == 1:
+        field_id, test = field_tests[0]
+        return lambda row: test(row[field_id])
+    def predicate(row):
+        for field_id, test in field_tests:
+            if not test(row[field_id]):
+                return False
+        return True
+    return predicate
+
+logger = logging.getLogger("csvquery")
+logger.addHandler(logging.NullHandler())
+
+instrumentation_hooks = []
+# each thread collects the messages of its own queries
+message_state = threading.local()
+
+def get_message_collectors():
+    if not hasattr(message_state, "collectors"):
+        message_state.collectors = []
+    return message_state.collectors
+
+def add_hook(hook):
+    if not hook in instrumentation_hooks:
+        instrumentation_hooks.append(hook)
+
+def remove_hook(hook):
+    if hook in instrumentation_hooks:
+        instrumentation_hooks.remove(hook)
+
+def is_instrumented():
+    return len(instrumentation_hooks) > 0 or logger.isEnabledFor(logging.DEBUG)
+
+def emit_event(event):
+    if not is_instrumented():
+        return
+    logger.debug("%s", event)
+    for hook in instrumentation_hooks:
+        hook(event)
+
+def get_row_count(value):
+    if type(value) is Dataset:
+        return len(value.data)
+    if type(value) is GroupedDataset:
+        return len(value.dataset.data)
+    return None
+
+# reports the time and row counts of an operation to the hooks, costing one check when nothing listens
+def instrumented(operation):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not is_instrumented():
+                return function(*args, **kwargs)
+            rows = get_row_count(args[0]) if len(args) > 0 else None
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            emit_event({"operation": operation, "rows": rows, "result_rows": get_row_count(result), "seconds": time.perf_counter() - start})
+            return result
+        return wrapper
+    return decorator
+
+def get_cache_key(value):
+    if type(value) is Query:
+        value = value.filter_object
+    if type(value) is dict:
+        return ("dict", tuple(sorted([(repr(key), get_cache_key(item)) for key, item in value.items()])))
+    if type(value) in (list, tuple):
+        return ("list", tuple([get_cache_key(item) for item in value]))
+    if type(value) in (set, frozenset):
+        return ("set", frozenset([get_cache_key(item) for item in value]))
+    hash(value)
+    return (type(value).__name__, value)
+
+# remembers results per dataset until it is modified, see Dataset.set_cache
+def cached_result(operation):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._cache == None:
+                return method(self, *args, **kwargs)
+            key_args, key_kwargs = args, kwargs
+            if operation == "query":
+                # the filter is normalized first, so {"a": 1} and {"a": {"eq": 1}} share an entry, and workers don't change the result
+                if len(args) > 0 and type(args[0]) is dict:
+                    key_args = (Query(args[0]),)
+                key_args = key_args[:1]
+                key_kwargs = {name: value for name, value in kwargs.items() if name != "workers"}
+            try:
+                key = (operation, get_cache_key(key_args), get_cache_key(key_kwargs))
+            except TypeError:
+                return method(self, *args, **kwargs)
+
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self._cache_stats["hits"] += 1
+                result = self._cache[key]
+            else:
+                self._cache_stats["misses"] += 1
+                result = method(self, *args, **kwargs)
+                if result is self:
+                    return result
+                self._cache[key] = result
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+                    self._cache_stats["evictions"] += 1
+            if type(result) is Dataset:
+                return result._cached_copy()
+            return result
+        return wrapper
+    return decorator
+
+class Query:
+
+    def __init__(self, filter_object=None):
+        if filter_object == None:
+            filter_object = {}
+        self.filter_object = None
+        self._plans = {}
+        if type(filter_object) is not dict:
+            error_message("Query: parameter 'filter_object' must be of type 'dict'")
+            return
+
+        self.filter_object = {}
+        for field, operations in filter_object.items():
+            if type(operations) is not dict:
+                operations = {Operators.equal: operations}
+            self.filter_object[field] = operations
+
+    def _bind(self, fields, indexed_field="", typed_fields={}, vectorized=False):
+        key = (tuple(fields), indexed_field, tuple(typed_fields.items()), vectorized)
+        if not key in self._plans:
+            self._plans[key] = self._compile(fields, indexed_field, typed_fields, vectorized)
+        return self._plans[key]
+
+    def _compile(self, fields, indexed_field, typed_fields, vectorized):
+        index_conditions = {}
+        field_tests = []
+        column_tests = []
+
+        for field, operations in self.filter_object.items():
+            if not field in fields:
+                error_message(f"Query: field \'{field}\' does not exist, skipping")
+                continue
+
+            operations = dict(operations)
+            comparison = operations.pop(Operators.comparison, None)
+
+            if field == indexed_field:
+                edges = []
+                for edge_operators in (index_low_operators, index_high_operators):
+                    for operator in operations:
+                        if operator in edge_operators:
+                            edges.append(operator)
+                            break
+                index_conditions = {operator: value for operator, value in operations.items() if operator in edges}
+                operations = {operator: value for operator, value in operations.items() if not operator in edges}
+                # "in" is looked up in the index too, but still tested on the rows since the index only compares keys
+                if Operators.inside in operations and type(operations[Operators.inside]) in (list, tuple, set):
+                    index_conditions[Operators.inside] = operations[Operators.inside]
+
+            if field in typed_fields and (comparison == None or comparison is typed_fields[field]):
+                # the field has a parsed column, so compare native values instead of strings
+                convert = get_converter(typed_fields[field].key)
+                if vectorized:
+                    masks = [compile_mask(operator, value, convert) for operator, value in operations.items()]
+                    if len(masks) > 0:
+                        column_tests.append((field, all_masks(masks)))
+                    continue
+                tests = [compile_operation(operator, value, native_comparison, convert) for operator, value in operations.items()]
+                if len(tests) > 0:
+                    column_tests.append((field, all_tests(tests)))
+                continue
+
+            if comparison == None:
+                if uses_ordering(operations):
+                    error_message(f"Query: comparison not specified for \'{field}\' filter, using default comparison")
+                comparison = Comparisons.default
+            elif type(comparison) is not types.FunctionType:
+                error_message(f"Query: comparison for \'{field}\' filter is not of type 'FunctionType', using default comparison instead")
+                comparison = Comparisons.default
+
+            if len(operations) > 0:
+                tests = [compile_operation(operator, value, comparison) for operator, value in operations.items()]
+                field_tests.append((fields.index(field), all_tests(tests)))
+
+        return index_conditions, row_predicate(field_tests), column_tests
+
+encoding_max_ratio = 1 / 16
+
+class DictionaryEncoding:
+
+    def __init__(self, values=None, lookup=None):
+        self.codes = array("l")
+        self.values = [] if values == None else values
+        self.lookup = {} if lookup == None else lookup
+
+    def encode(self, rows, field_id, limit=None):
+        values = self.values
+        lookup = self.lookup
+        codes = array("l")
+        for row in rows:
+            value = row[field_id]
+            code = lookup.get(value)
+            if code == None:
+                if limit != None and len(values) == limit:
+                    return None
+                code = lookup[value] = len(values)
+                values.append(value)
+            elif type(row) is list:
+                # equal strings share one object, so each distinct value is only stored once
+                row[field_id] = values[code]
+            codes.append(code)
+        return codes
+
+    # codes are stored in one byte each when there are few enough values
+    def narrow(self, codes):
+        typecode = "B" if len(self.values) <= 256 else "l"
+        return codes if codes.typecode == typecode else array(typecode, codes)
+
+    # returns None if the field has more than 'limit' distinct values
+    def build(self, rows, field_id, limit=None):
+        codes = self.encode(rows, field_id, limit)
+        if codes == None:
+            return None
+        self.codes = self.narrow(codes)
+        return self
+
+# inserts values[i] before position points[i] of the sequence; points must be in ascending order
+def merge_insert(sequence, points, values, in_place=False):
+    if len(points) == 0:
+        return sequence
+    if points[0] == len(sequence):
+        if in_place:
+            sequence.extend(values)
+            return sequence
+        return sequence + values
+    merged = sequence[:0]
+    previous = 0
+    for point, value in zip(points, values):
+        merged.extend(sequence[previous:point])
+        merged.append(value)
+        previous = point
+    merged.extend(sequence[previous:])
+    return merged
+
+# positions of the rows that were inserted at 'points', and the new positions of the rows that were already there
+def get_inserted_positions(points):
+    return [point + i for i, point in enumerate(points)]
+
+def shift_positions(positions, points):
+    return [position + bisect.bisect_right(points, position) for position in positions]
+
+class SortedIndex:
+
+    def __init__(self, field, comparison):
+        self.field = field
+        self.comparison = comparison
+        self.reset()
+
+    def reset(self):
+        self.keys = None
+        self.order = None
+
+    def build(self, dataset):
+        if self.keys != None:
+            return
+        keys = dataset.typed_column(self.field) if dataset.schema.get(self.field) is self.comparison else None
+        if keys == None:
+            key = comparison_key(self.comparison)
+            field_id = dataset.fields.index(self.field)
+            keys = [key(row[field_id]) for row in dataset.data]
+        if self.order == None:
+            self.order = array("q", sorted(range(len(keys)), key=keys.__getitem__))
+        self.keys = [keys[i] for i in self.order]
+
+    # adds rows that were merged into the data at 'points' (see merge_insert)
+    def insert(self, dataset, points):
+        if self.keys == None:
+            self.reset()
+            return
+        key = comparison_key(self.comparison)
+        field_id = dataset.fields.index(self.field)
+        positions = get_inserted_positions(points)
+        try:
+            new_keys = [key(dataset.data[i][field_id]) for i in positions]
+        except ValueError:
+            self.reset()
+            return
+        if points[0] < len(self.keys):
+            self.order = array("q", shift_positions(self.order, points))
+        order = sorted(range(len(new_keys)), key=new_keys.__getitem__)
+        new_keys = [new_keys[i] for i in order]
+        key_points = [bisect.bisect_right(self.keys, value) for value in new_keys]
+        self.keys = merge_insert(self.keys, key_points, new_keys, True)
+        self.order = merge_insert(self.order, key_points, array("q", [positions[i] for i in order]), True)
+
+    # returns (positions, low, high) chunks that cover every row matching 'operations', or None if it can't help
+    def probe(self, operations, comparison, native):
+        if native and not comparison is self.comparison:
+            return None
+        key = comparison_key(self.comparison)
+        low, high = 0, len(self.keys)
+        used = False
+        for operator, value in operations.items():
+            try:
+                if operator == Operators.equal:
+                    value = key(str(value))
+                    low = max(low, bisect.bisect_left(self.keys, value))
+                    high = min(high, bisect.bisect_right(self.keys, value))
+                elif not operator in ordering_operators or not comparison is self.comparison:
+                    continue
+                elif operator == Operators.greater_than:
+                    low = max(low, bisect.bisect_right(self.keys, key(str(value))))
+                elif operator == Operators.greater_than_or_equal:
+                    low = max(low, bisect.bisect_left(self.keys, key(str(value))))
+                elif operator == Operators.less_than:
+                    high = min(high, bisect.bisect_left(self.keys, key(str(value))))
+                elif operator == Operators.less_than_or_equal:
+                    high = min(high, bisect.bisect_right(self.keys, key(str(value))))
+            except ValueError:
+                if operator in ordering_operators:
+                    continue
+                low, high = 0, 0
+            used = True
+
+        if Operators.inside in operations:
+            chunks = []
+            for value in set(str(x) for x in operations[Operators.inside]):
+                try:
+                    value = key(value)
+                except ValueError:
+                    continue
+                start = max(low, bisect.bisect_left(self.keys, value))
+                end = min(high, bisect.bisect_right(self.keys, value))
+                if start < end:
+                    chunks.append((self.order, start, end))
+            return chunks
+
+        if not used:
+            return None
+        return [(self.order, low, max(low, high))]
+
+class HashIndex:
+
+    def __init__(self, field):
+        self.field = field
+        self.comparison = None
+        self.reset()
+
+    def reset(self):
+        self.buckets = None
+
+    def build(self, dataset):
+        if self.buckets != None:
+            return
+        field_id = dataset.fields.index(self.field)
+        buckets = {}
+        for i, row in enumerate(dataset.data):
+            value = row[field_id]
+            if value in buckets:
+                buckets[value].append(i)
+            else:
+                buckets[value] = [i]
+        self.buckets = buckets
+
+    def insert(self, dataset, points):
+        if self.buckets == None:
+            return
+        field_id = dataset.fields.index(self.field)
+        buckets = self.buckets
+        if points[0] < len(dataset.data) - len(points):
+            for value, bucket in buckets.items():
+                buckets[value] = shift_positions(bucket, points)
+        for i in get_inserted_positions(points):
+            value = dataset.data[i][field_id]
+            if value in buckets:
+                bisect.insort(buckets[value], i)
+            else:
+                buckets[value] = [i]
+
+    def probe(self, operations, comparison, native):
+        if native:
+            return None
+        values = None
+        if Operators.equal in operations:
+            values = [operations[Operators.equal]]
+        if Operators.inside in operations:
+            inside = set(str(x) for x in operations[Operators.inside])
+            values = inside if values == None else [value for value in values if value in inside]
+        if values == None:
+            return None
+        chunks = []
+        for value in values:
+            bucket = self.buckets.get(value) if type(value) is str else None
+            if bucket != None:
+                chunks.append((bucket, 0, len(bucket)))
+        return chunks
+
 class Dataset:
 
     # UTILITY
@@ -49,6 +723,18 @@ class Dataset:
         self.fields = []
         self.indexed_field = ""
         self.indexed_comparison = Comparisons.default
+        self._shared_rows = False
+        self.schema = {}
+        self._columns = {}
+        self._indexed_keys = None
+        self.engine = Engines.python
+        self.indexes = {}
+        self._cache = None
+        self._cache_size = 0
+        self._followed_file = None
+        self.encoded_fields = set()
+        self._encodings = {}
+        self._cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
 
     def get_field_ids(self, field_names):
         if type(field_names) is str:
@@ -70,20 +756,514 @@ class Dataset:
     def row_to_dict(self, row):
         return {field: row[i] for i, field in enumerate(self.fields)}
 
+    def _share_rows(self, dataset):
+        # rows are shared between the two datasets until one of them mutates them
+        self._shared_rows = True
+        dataset._shared_rows = True
+
+    def _own_rows(self):
+        if self._shared_rows:
+            self.data = [list(row) for row in self.data]
+            self._shared_rows = False
+
+    def _clear_cache(self):
+        if self._cache != None:
+            self._cache.clear()
+
+    # cached results are handed out as copies that share rows, so changing one doesn't change the cache
+    def _cached_copy(self):
+        dataset = Dataset()
+        dataset.data = list(self.data)
+        dataset.fields = list(self.fields)
+        dataset.schema = dict(self.schema)
+        dataset._columns = dict(self._columns)
+        dataset.engine = self.engine
+        dataset.indexed_field = self.indexed_field
+        dataset.indexed_comparison = self.indexed_comparison
+        dataset._indexed_keys = self._indexed_keys
+        dataset.encoded_fields = set(self.encoded_fields)
+        dataset._encodings = dict(self._encodings)
+        self._share_rows(dataset)
+        return dataset
+
+    def _invalidate(self, field_names=None):
+        self._clear_cache()
+        if field_names == None or self.indexed_field in field_names:
+            self._indexed_keys = None
+        if field_names == None:
+            self._columns = {}
+            self._encodings = {}
+            for index in self.indexes.values():
+                index.reset()
+            return
+        for field in field_names:
+            if field in self._columns:
+                del self._columns[field]
+            if field in self._encodings:
+                del self._encodings[field]
+            if field in self.indexes:
+                self.indexes[field].reset()
+
+    def _index_candidates(self, query, typed_fields, limit):
+        best = None
+        best_count = limit
+        for field, operations in query.filter_object.items():
+            if not field in self.indexes or not field in self.fields:
+                continue
+            comparison = operations.get(Operators.comparison)
+            if comparison == None:
+                comparison = typed_fields.get(field, Comparisons.default)
+            index = self.indexes[field]
+            try:
+                index.build(self)
+            except ValueError:
+                error_message(f"Dataset.query: a value of \'{field}\' can't be compared with the comparison of its index, skipping index")
+                continue
+            chunks = index.probe(operations, comparison, field in typed_fields)
+            if chunks == None:
+                continue
+            count = sum([high - low for positions, low, high in chunks])
+            if count < best_count:
+                best = chunks
+                best_count = count
+                best_field = field
+        if best == None:
+            return None, None
+        if len(best) == 1:
+            positions, low, high = best[0]
+            return sorted(positions[low:high]), best_field
+        return sorted([i for positions, low, high in best for i in positions[low:high]]), best_field
+
+    def _numeric_values(self, field_name, caller):
+        field_ids = self.get_field_ids(self.fields if field_name == None else field_name)
+        if len(field_ids) > 1:
+            error_message(f"Dataset.{caller}: Not a single-field dataset, using first field")
+        elif len(field_ids) == 0:
+            error_message(f"Dataset.{caller}: Empty dataset, cannot get values")
+            return []
+        if self.engine == Engines.numpy:
+            column = self._numpy_column(self.fields[field_ids[0]])
+        else:
+            column = self.typed_column(self.fields[field_ids[0]])
+        if column is not None:
+            return column
+        field_id = field_ids[0]
+        return [float(row[field_id]) for row in self.data]
+
+    def _matching_positions(self, positions, predicate, column_tests, vectorized):
+        data = self.data
+        if len(column_tests) == 0:
+            return [i for i in positions if predicate(data[i])]
+
+        if vectorized:
+            mask = None
+            if type(positions) is not range:
+                positions = numpy.array(positions, dtype=numpy.int64)
+            for field, column_mask in column_tests:
+                column = self._numpy_column(field)
+                field_mask = column_mask(column[positions.start:positions.stop] if type(positions) is range else column[positions])
+                mask = field_mask if mask is None else mask & field_mask
+            if type(positions) is range:
+                positions = numpy.flatnonzero(mask) + positions.start
+            else:
+                positions = positions[mask]
+            return [i for i in positions.tolist() if predicate(data[i])]
+
+        for field, test in column_tests:
+            column = self._columns[field]
+            positions = [i for i in positions if test(column[i])]
+        return [i for i in positions if predicate(data[i])]
+
+    def _parallel_positions(self, positions, predicate, column_tests, vectorized, workers):
+        pool = get_process_pool(workers, True)
+        if pool == None:
+            error_message("Dataset.query: parallel queries need the 'fork' start method, running on one core")
+            return None
+        task_id = next(parallel_task_ids)
+        parallel_tasks[task_id] = (self, predicate, column_tests, vectorized)
+        try:
+            with pool:
+                chunks = split_positions(positions, workers)
+                matched = []
+                for chunk_positions in pool.map(run_query_task, [task_id] * len(chunks), chunks):
+                    matched.extend(chunk_positions)
+        finally:
+            del parallel_tasks[task_id]
+        return matched
+
+    # narrows positions down to the rows whose codes match the "eq" and "in" filters of encoded fields
+    def _encoded_candidates(self, filter_object, typed_fields, positions):
+        for field, operations in filter_object.filter_object.items():
+            # the indexed field's filters are answered by the index, which compares keys rather than strings
+            if field in typed_fields or field == self.indexed_field or not field in self.encoded_fields or not field in self.fields:
+                continue
+            allowed = None
+            for operator, value in operations.items():
+                if operator == Operators.equal:
+                    codes = set()
+                    if type(value) is str:
+                        codes = {self.encoded_column(field).lookup.get(value)}
+                elif operator == Operators.inside and type(value) in (list, tuple, set):
+                    codes = {self.encoded_column(field).lookup.get(str(v)) for v in value}
+                else:
+                    continue
+                codes.discard(None)
+                allowed = codes if allowed == None else allowed & codes
+            if allowed == None:
+                continue
+
+            codes = self.encoded_column(field).codes
+            if len(allowed) == 0:
+                positions = []
+            elif type(positions) is range and codes.typecode == "B":
+                # one byte codes are matched by translating them into a mask of zeros and ones
+                table = bytearray(256)
+                for code in allowed:
+                    table[code] = 1
+                positions = list(itertools.compress(positions, codes[positions.start:positions.stop].tobytes().translate(table)))
+            elif type(positions) is range:
+                positions = [i for i, code in zip(positions, codes[positions.start:positions.stop]) if code in allowed]
+            else:
+                positions = [i for i in positions if codes[i] in allowed]
+            return positions, field
+        return None, None
+
+    def _sorted_keys(self):
+        if self._indexed_keys == None:
+            comparison = self.indexed_comparison
+            keys = self.typed_column(self.indexed_field) if self.schema.get(self.indexed_field) is comparison else None
+            if keys == None:
+                key = comparison_key(comparison)
+                field_id = self.fields.index(self.indexed_field)
+                keys = [key(row[field_id]) for row in self.data]
+            self._indexed_keys = keys
+        return self._indexed_keys
+
+    # 'quiet' leaves errors to the caller, for lookups that run once per row
+    def _index_ranges(self, conditions, quiet=False):
+        try:
+            keys = self._sorted_keys()
+        except ValueError:
+            if not quiet:
+                error_message(f"Dataset.query: a value of \'{self.indexed_field}\' can't be compared with the comparison of its index, returning empty dataset")
+            return []
+        key = comparison_key(self.indexed_comparison)
+        low, high = 0, len(keys)
+        try:
+            for operator, value in conditions.items():
+                if operator == Operators.equal:
+                    try:
+                        value = key(str(value))
+                    except (ValueError, OverflowError):
+                        # a value that can't be converted is equal to none of the keys
+                        return []
+                    low = max(low, bisect.bisect_left(keys, value))
+                    high = min(high, bisect.bisect_right(keys, value))
+                elif operator == Operators.greater_than:
+                    low = max(low, bisect.bisect_right(keys, key(str(value))))
+                elif operator == Operators.greater_than_or_equal:
+                    low = max(low, bisect.bisect_left(keys, key(str(value))))
+                elif operator == Operators.less_than:
+                    high = min(high, bisect.bisect_left(keys, key(str(value))))
+                elif operator == Operators.less_than_or_equal:
+                    high = min(high, bisect.bisect_right(keys, key(str(value))))
+        except ValueError:
+            if not quiet:
+                error_message(f"Dataset.query: a filter value for \'{self.indexed_field}\' can't be compared with the comparison of its index, returning empty dataset")
+            return []
+
+        if not Operators.inside in conditions:
+            return [(low, high)] if low < high else []
+
+        # every value of an "in" list is a separate point lookup
+        ranges = set()
+        for value in conditions[Operators.inside]:
+            try:
+                value = key(str(value))
+            except ValueError:
+                continue
+            start = max(low, bisect.bisect_left(keys, value))
+            end = min(high, bisect.bisect_right(keys, value))
+            if start < end:
+                ranges.add((start, end))
+        return sorted(ranges)
+
+    def _equal_range(self, value):
+        ranges = self._index_ranges({Operators.equal: value}, True)
+        if len(ranges) == 0:
+            return 0, 0
+        return ranges[0]
+
+    def _derivation_column(self, field, batch):
+        if batch and self.engine == Engines.numpy and self._numpy_column(field) is not None:
+            return self._numpy_column(field)
+        column = self.typed_column(field)
+        if column != None:
+            return column.tolist() if batch else column
+        field_id = self.fields.index(field)
+        return [row[field_id] for row in self.data]
+
+    # returns the derived value of every row, or None if 'derivation' takes the row as a dictionary
+    def _derive(self, derivation, columns, batch, caller):
+        if type(derivation) is str:
+            try:
+                derivation, columns = compile_expression(derivation, self.fields)
+            except SyntaxError as error:
+                error_message(f"Dataset.{caller}: expression can't be compiled ({error.msg}), halting")
+                return []
+        if columns == None:
+            return None
+        missing = [field for field in columns if not field in self.fields]
+        if len(missing) > 0:
+            error_message(f"Dataset.{caller}: fields {missing} do not exist, halting")
+            return []
+
+        values = [self._derivation_column(field, batch) for field in columns]
+        if not batch:
+            if len(values) == 0:
+                return [derivation() for row in self.data]
+            return list(map(derivation, *values))
+
+        results = derivation(*values)
+        if hasattr(results, "tolist"):
+            results = results.tolist()
+        results = list(results)
+        if len(results) != len(self.data):
+            error_message(f"Dataset.{caller}: batch derivation returned {len(results)} values for {len(self.data)} rows, halting")
+            return []
+        return results
+
     # USER
 
-    def already_indexed(self, field, comparison = Comparisons.default):
+    @instrumented("append_rows")
+    def append_rows(self, rows):
+        rows = [list(row) for row in rows]
+        invalid = [row for row in rows if len(row) != len(self.fields)]
+        if len(invalid) > 0:
+            error_message(f"Dataset.append_rows: {len(invalid)} rows don't have {len(self.fields)} values, skipping them")
+            rows = [row for row in rows if len(row) == len(self.fields)]
+        if len(rows) == 0:
+            return self
+        if type(self.data) is not list:
+            self.data = list(self.data)
+        start = len(self.data)
+
+        # new rows are sorted and merged into the indexed order instead of sorting everything again
+        points = [start] * len(rows)
+        if self.indexed_field in self.fields:
+            field_id = self.fields.index(self.indexed_field)
+            key = comparison_key(self.indexed_comparison)
+            try:
+                keys = self._sorted_keys()
+                new_keys = [key(row[field_id]) for row in rows]
+            except ValueError:
+                error_message(f"Dataset.append_rows: a value of \'{self.indexed_field}\' can't be compared, the data is no longer indexed")
+                self.indexed_field = ""
+                self.indexed_comparison = Comparisons.default
+                self._indexed_keys = None
+            else:
+                order = sorted(range(len(rows)), key=new_keys.__getitem__)
+                rows = [rows[i] for i in order]
+                new_keys = [new_keys[i] for i in order]
+                points = [bisect.bisect_right(keys, value) for value in new_keys]
+                if not keys is self._columns.get(self.indexed_field):
+                    self._indexed_keys = merge_insert(keys, points, new_keys)
+
+        for field, column in list(self._columns.items()):
+            if column == None:
+                continue
+            comparison = self.schema[field]
+            field_id = self.fields.index(field)
+            try:
+                values = array(comparison.typecode, [comparison.key(row[field_id]) for row in rows])
+            except (ValueError, OverflowError):
+                del self._columns[field]
+                continue
+            merged = merge_insert(column, points, values)
+            if self._indexed_keys is column:
+                self._indexed_keys = merged
+            self._columns[field] = merged
+
+        for field, encoding in list(self._encodings.items()):
+            # the values are copied, since datasets made by select share them
+            extended = DictionaryEncoding(list(encoding.values), dict(encoding.lookup))
+            extended.codes = extended.narrow(merge_insert(array("l", encoding.codes), points, extended.encode(rows, self.fields.index(field))))
+            self._encodings[field] = extended
+
+        self.data = merge_insert(self.data, points, rows, True)
+        for index in self.indexes.values():
+            index.insert(self, points)
+        self._clear_cache()
+        return self
+
+    def refresh(self):
+        if self._followed_file == None:
+            error_message("Dataset.refresh: the Dataset isn't following a file, see 'follow_csv'")
+            return self
+        followed = self._followed_file
+        with open(followed["path"], "rb") as csv_file:
+            if os.fstat(csv_file.fileno()).st_size < followed["offset"]:
+                error_message(f"Dataset.refresh: \'{followed['path']}\' is shorter than before, it was probably replaced, skipping")
+                return self
+            csv_file.seek(followed["offset"])
+            chunk = csv_file.read()
+
+        # only whole lines are read, and a line break inside quotes doesn't end a row
+        end = chunk.rfind(b"\n") + 1
+        while end > 0 and chunk.count(b'"', 0, end) % 2 == 1:
+            end = chunk.rfind(b"\n", 0, end - 1) + 1
+        if end == 0:
+            return self
+        followed["offset"] += end
+
+        text = chunk[:end].decode(followed["encoding"])
+        rows = [row for row in csv.reader(io.StringIO(text, newline=""), delimiter=followed["delimiter"]) if row != []]
+        if len(self.fields) == 0 and len(rows) > 0:
+            self.fields = rows.pop(0)
+        return self.append_rows(rows)
+
+    def set_cache(self, size=128):
+        if size == None or size <= 0:
+            self._cache = None
+            self._cache_size = 0
+            return self
+        if self._cache == None:
+            self._cache = collections.OrderedDict()
+        self._cache_size = size
+        while len(self._cache) > size:
+            self._cache.popitem(last=False)
+            self._cache_stats["evictions"] += 1
+        return self
+
+    def cache_stats(self):
+        return dict(self._cache_stats, entries=0 if self._cache == None else len(self._cache), size=self._cache_size)
+
+    def set_schema(self, schema):
+        if type(schema) is not dict:
+            error_message("Dataset.set_schema: parameter 'schema' must be of type 'dict'")
+            return self
+        for field, comparison in schema.items():
+            if type(comparison) is not types.FunctionType or getattr(comparison, "typecode", None) == None:
+                error_message(f"Dataset.set_schema: type of \'{field}\' must be a typed comparison such as 'Comparisons.integers', skipping")
+                continue
+            if self.schema.get(field) is not comparison:
+                self._invalidate([field])
+            self.schema[field] = comparison
+        return self
+
+    def set_engine(self, engine):
+        if engine == Engines.numpy and numpy == None:
+            error_message("Dataset.set_engine: the numpy engine requires the 'numpy' package, using the python engine")
+            engine = Engines.python
+        elif not engine in (Engines.python, Engines.numpy):
+            error_message(f"Dataset.set_engine: engine \'{engine}\' does not exist, using the python engine")
+            engine = Engines.python
+        if self.engine != engine:
+            self._clear_cache()
+        self.engine = engine
+        return self
+
+    @instrumented("add_index")
+    def add_index(self, field, index_type=IndexTypes.sorted, comparison=Comparisons.default):
+        if not field in self.fields:
+            error_message(f"Dataset.add_index: field \'{field}\' does not exist, halting indexing")
+            return self
+        if index_type == IndexTypes.hash:
+            self.indexes[field] = HashIndex(field)
+        elif index_type == IndexTypes.sorted:
+            if type(comparison) is not types.FunctionType:
+                error_message("Dataset.add_index: parameter 'comparison' must be of type 'FunctionType', halting indexing")
+                return self
+            self.indexes[field] = SortedIndex(field, comparison)
+        else:
+            error_message(f"Dataset.add_index: index type \'{index_type}\' does not exist, halting indexing")
+            return self
+        try:
+            self.indexes[field].build(self)
+        except ValueError:
+            error_message(f"Dataset.add_index: a value of \'{field}\' can't be compared with 'comparison', halting indexing")
+            del self.indexes[field]
+        return self
+
+    def remove_index(self, field):
+        if field in self.indexes:
+            del self.indexes[field]
+        return self
+
+    def typed_column(self, field):
+        if not field in self.schema or not field in self.fields:
+            return None
+        if not field in self._columns:
+            comparison = self.schema[field]
+            field_id = self.fields.index(field)
+            try:
+                self._columns[field] = array(comparison.typecode, [comparison.key(row[field_id]) for row in self.data])
+            except (ValueError, OverflowError):
+                error_message(f"Dataset.typed_column: field \'{field}\' has values that don't match its schema, using strings instead")
+                self._columns[field] = None
+        return self._columns[field]
+
+    def encoded_column(self, field):
+        if not field in self.encoded_fields or not field in self.fields:
+            return None
+        if not field in self._encodings:
+            self._encodings[field] = DictionaryEncoding().build(self.data, self.fields.index(field))
+        return self._encodings[field]
+
+    def encode(self, field_names=None):
+        if field_names == None:
+            # without field names, only the fields that have few distinct values are encoded
+            limit = max(1, int(len(self.data) * encoding_max_ratio))
+            for field in self.fields:
+                encoding = DictionaryEncoding().build(self.data, self.fields.index(field), limit)
+                if encoding != None:
+                    self.encoded_fields.add(field)
+                    self._encodings[field] = encoding
+            return self
+        if type(field_names) is str:
+            field_names = [field_names]
+        for field in field_names:
+            if not field in self.fields:
+                error_message(f"Dataset.encode: field \'{field}\' does not exist, skipping")
+                continue
+            self.encoded_fields.add(field)
+            self.encoded_column(field)
+        return self
+
+    def _numpy_column(self, field):
+        column = self.typed_column(field)
+        if column == None:
+            return None
+        if len(column) == 0:
+            return numpy.array([], dtype=column.typecode)
+        return numpy.frombuffer(column, dtype=column.typecode)
+
+    def already_indexed(self, field, comparison = Comparisons.default, verify=False):
         if type(comparison) is not types.FunctionType:
             error_message("Dataset.already_indexed: parameter 'comparison' must be of type 'FunctionType'")
             return self
         if type(field) is not str:
             error_message("Dataset.already_indexed: parameter 'field' must be of type 'str'")
             return self
+        if verify and field in self.fields:
+            key = comparison_key(comparison)
+            field_id = self.fields.index(field)
+            try:
+                keys = [key(row[field_id]) for row in self.data]
+                in_order = not any(keys[i + 1] < keys[i] for i in range(len(keys) - 1))
+            except ValueError:
+                in_order = False
+            if not in_order:
+                error_message(f"Dataset.already_indexed: the data is not sorted by \'{field}\', ignoring")
+                return self
         
         self.indexed_field = field
         self.indexed_comparison = comparison
+        self._indexed_keys = None
+        self._clear_cache()
         return self
 
+    @instrumented("index")
     def index(self, field, comparison = Comparisons.default):
         if type(comparison) is not types.FunctionType: # TODO should this be fatal? or just use default comparison?
             error_message("Dataset.index: parameter 'comparison' must be of type 'FunctionType', halting indexing")
@@ -95,184 +1275,232 @@ class Dataset:
             error_message(f"Dataset.index: field \'{field}\' does not exist, halting indexing")
             return self
 
-        def quick_sort(field, low, high, comparison): 
-            if low < high: 
-                p = partition(field, low, high, comparison)
-        
-                quick_sort(field, low, p-1, comparison)
-                quick_sort(field, p+1, high, comparison)
-        
-        def partition(field, low, high, comparison):
-            i = low-1
-            pivot = self.data[high][field]
-        
-            for j in range(low, high):
-                if comparison(self.data[j][field], pivot):
-                    i = i+1
-                    self.data[i], self.data[j] = self.data[j], self.data[i]
-            
-            self.data[i+1], self.data[high] = self.data[high], self.data[i+1]
-
-            return i+1
-        
-        sys.setrecursionlimit(10000)
-        quick_sort(self.fields.index(field), 0, len(self.data)-1, comparison)
+        field_id = self.fields.index(field)
+        keys = self.typed_column(field) if self.schema.get(field) is comparison else None
+        if keys == None:
+            key = comparison_key(comparison)
+            try:
+                keys = [key(row[field_id]) for row in self.data]
+            except ValueError:
+                error_message(f"Dataset.index: a value of \'{field}\' can't be compared with 'comparison', halting indexing")
+                return self
+
+        order = sorted(range(len(self.data)), key=keys.__getitem__)
+        self.data = [self.data[i] for i in order]
+        self._columns = {f: (c if c == None else array(c.typecode, [c[i] for i in order])) for f, c in self._columns.items()}
+        for f, encoding in self._encodings.items():
+            self._encodings[f] = DictionaryEncoding(encoding.values, encoding.lookup)
+            self._encodings[f].codes = array(encoding.codes.typecode, [encoding.codes[i] for i in order])
+        for index in self.indexes.values():
+            index.reset()
+        self._clear_cache()
         self.indexed_field = field
         self.indexed_comparison = comparison
+        self._indexed_keys = self._columns[field] if self._columns.get(field) != None and self.schema.get(field) is comparison else [keys[i] for i in order]
         
         return self
 
-    def query(self, filter_object=None):
-        if filter_object == None:
-            return self
-        if type(filter_object) is not dict:
+    @instrumented("order_by")
+    @cached_result("order_by")
+    def order_by(self, field_names, descending=False, limit=None, comparisons=None):
+        if type(field_names) is str:
+            field_names = [field_names]
+        if type(field_names) is not list and type(field_names) is not tuple:
+            error_message("Dataset.order_by: parameter 'field_names' must be of type 'list' or 'tuple'")
             return Dataset()
-        for field, operators in filter_object.items():
-            if type(operators) is not dict:
-                filter_object[field] = {Operators.equal: operators}
-
-        def double_binary_search(key, conditions):
-
-            def binary_search(low, high, comparison, direction):
-                if low + 1 == high:
-                    return high
-                lower_middle_index = math.floor((high+low)/2)
-                upper_middle_index = math.ceil((high+low)/2)
-                median = self.data[upper_middle_index][key]
-                if comparison(median) == direction:
-                    return binary_search(lower_middle_index, high, comparison, direction)
-                else:
-                    return binary_search(low, upper_middle_index, comparison, direction)
-
-            lowest = 0
-            highest = len(self.data) - 1
-
-            used_operators = []
-
-            def get_edge(comparators, default):
-                for operator, value in conditions.items():
-                    if operator in comparators:
-                        comparator = comparators[operator]
-                        comparison_1 = None
-                        comparison_2 = None
-
-                        if comparator[0]:
-                            comparison_1 = lambda a : self.indexed_comparison(a, value)
-                        else:
-                            comparison_1 = lambda a : self.indexed_comparison(value, a)
-                        
-                        if comparator[1]:
-                            comparison_2 = lambda a : not comparison_1(a)
-                        else:
-                            comparison_2 = comparison_1
-
-                        used_operators.append(operator)
-                        return binary_search(lowest, highest, comparison_2, comparator[0])
-                return default
-
-            low_edge = get_edge({
-                Operators.equal                 :   (True, False),
-                Operators.greater_than          :   (False, False),
-                Operators.greater_than_or_equal :   (True, True),
-            }, lowest)
-
-            high_edge = get_edge({
-                Operators.equal                 :   (False, False),
-                Operators.less_than             :   (True, False),
-                Operators.less_than_or_equal    :   (False, True),
-            }, highest)
-
-            for operator in used_operators:
-                if operator in conditions:
-                    del conditions[operator]
-
-            if(high_edge < low_edge or high_edge >= len(self.data) or low_edge < 0):
-                error_message("Dataset.query.double_binary_search: Invalid high/low bounds, returning empty dataset")
-                return []
-            
-            if low_edge == high_edge:
-                return [self.data[low_edge]]
-
-            return self.data[low_edge:high_edge]
-        
-
-        result_data = []
+        if type(descending) is bool:
+            descending = [descending] * len(field_names)
+        if type(descending) is not list and type(descending) is not tuple:
+            error_message("Dataset.order_by: parameter 'descending' must be of type 'bool', 'list' or 'tuple'")
+            return Dataset()
+        if len(descending) != len(field_names):
+            error_message(f"Dataset.order_by: 'descending' has {len(descending)} values for {len(field_names)} fields, returning empty dataset")
+            return Dataset()
+        # the direction of a missing field is dropped along with it
+        descending = [reverse for field, reverse in zip(field_names, descending) if field in self.fields]
+        field_names = [field for field in field_names if field in self.fields]
+        if len(field_names) == 0:
+            error_message("Dataset.order_by: none of the fields exist, returning empty dataset")
+            return Dataset()
+        if comparisons == None:
+            comparisons = {}
 
-        if self.indexed_field in filter_object.keys():
-            result_data = double_binary_search(self.fields.index(self.indexed_field), filter_object[self.indexed_field])
+        columns = []
+        for field in field_names:
+            comparison = comparisons.get(field, self.schema.get(field, Comparisons.default))
+            keys = self.typed_column(field) if self.schema.get(field) is comparison else None
+            if keys == None:
+                key = comparison_key(comparison)
+                field_id = self.fields.index(field)
+                try:
+                    keys = [key(row[field_id]) for row in self.data]
+                except ValueError:
+                    error_message(f"Dataset.order_by: a value of \'{field}\' can't be compared, returning empty dataset")
+                    return Dataset()
+            columns.append(keys)
+
+        if len(set(descending)) == 1:
+            keys = columns[0] if len(columns) == 1 else list(zip(*columns))
+            position_key = keys.__getitem__
         else:
-            result_data = copy.deepcopy(self.data)
-
-        deletions = []
+            def compare(a, b):
+                for keys, reverse in zip(columns, descending):
+                    if keys[a] < keys[b]:
+                        return 1 if reverse else -1
+                    if keys[b] < keys[a]:
+                        return -1 if reverse else 1
+                return 0
+            position_key = functools.cmp_to_key(compare)
+        reverse = len(set(descending)) == 1 and descending[0]
+
+        positions = range(len(self.data))
+        # a heap of the first rows only costs O(n log k), a full sort is faster when most rows are kept
+        if limit != None and limit * 8 < len(self.data):
+            order = (heapq.nlargest if reverse else heapq.nsmallest)(limit, positions, key=position_key)
+        else:
+            order = sorted(positions, key=position_key, reverse=reverse)[:limit]
 
-        for i, row in enumerate(result_data):
+        dataset = Dataset()
+        dataset.data = [self.data[i] for i in order]
+        self._share_rows(dataset)
+        dataset.fields = list(self.fields)
+        dataset.schema = dict(self.schema)
+        dataset.engine = self.engine
+        if len(field_names) == 1 and not descending[0]:
+            dataset.already_indexed(field_names[0], comparisons.get(field_names[0], self.schema.get(field_names[0], Comparisons.default)))
+        return dataset
 
-            for field, operations in filter_object.items():
+    def _execute_query(self, filter_object, workers, plan):
+        if filter_object == None:
+            plan["access"] = "none"
+            return self
+        if type(filter_object) is dict:
+            filter_object = Query(filter_object)
+        elif type(filter_object) is not Query:
+            return Dataset()
+        if filter_object.filter_object == None:
+            return Dataset()
 
-                if not field in self.fields:
-                    error_message(f"Dataset.query: field \'{field}\' does not exist, skipping")
-                    continue
-                field_id = self.fields.index(field)
+        typed_fields = {}
+        for field in filter_object.filter_object:
+            if self.typed_column(field) != None:
+                typed_fields[field] = self.schema[field]
 
-                for operator, value in operations.items():
-
-                    def get_comparator(t, v):
-                        if not Operators.comparison in operations:
-                            error_message(f"Dataset.query.get_comparator: comparison not specified for \'{field}\' filter, using default comparison")
-                            filter_object[field]["comparison"] = Comparisons.default # so the message doesn't appear again
-                            return Comparisons.default(t, v)
-                        comparator = operations[Operators.comparison]
-                        if type(comparator) is not types.FunctionType:
-                            error_message(f"Dataset.query.get_comparator: comparison for \'{field}\' filter is not of type 'FunctionType', using default comparison instead")
-                            filter_object[field]["comparison"] = Comparisons.default
-                            return Comparisons.default(t, v)
-                        return comparator(t, v)
-
-                    if operator == Operators.comparison:
-                        continue
-                    elif operator in operator_functions:
-                        if not operator_functions[operator](row[field_id], value, get_comparator):
-                            deletions.append(i)
-                            break
-                    else:
-                        error_message(f"Dataset.query: operator \'{operator}\' does not exist, skipping")
+        vectorized = self.engine == Engines.numpy
+        index_conditions, predicate, column_tests = filter_object._bind(self.fields, self.indexed_field, typed_fields, vectorized)
 
-                if i in deletions:
-                    break
-        
-        for i in reversed(range(len(deletions))):
-            del result_data[deletions[i]]
+        positions = range(len(self.data))
+        if len(index_conditions) > 0:
+            ranges = self._index_ranges(index_conditions)
+            if len(ranges) == 1:
+                positions = range(*ranges[0])
+            else:
+                positions = [i for low, high in ranges for i in range(low, high)]
+            plan["access"] = "index"
+            plan["stages"].append({"stage": "index", "field": self.indexed_field, "operators": list(index_conditions), "rows": len(positions)})
+
+        # use a secondary index instead if it narrows the rows down further
+        candidates, index_field = self._index_candidates(filter_object, typed_fields, len(positions))
+        if candidates != None:
+            if len(positions) < len(self.data):
+                kept = positions if type(positions) is range else set(positions)
+                candidates = [i for i in candidates if i in kept]
+            positions = candidates
+            plan["access"] = "secondary index"
+            plan["stages"].append({"stage": "secondary index", "field": index_field, "type": type(self.indexes[index_field]) is HashIndex and IndexTypes.hash or IndexTypes.sorted, "rows": len(positions)})
+
+        candidates, encoded_field = self._encoded_candidates(filter_object, typed_fields, positions)
+        if candidates != None:
+            positions = candidates
+            if plan["access"] == "full scan":
+                plan["access"] = "dictionary"
+            plan["stages"].append({"stage": "dictionary", "field": encoded_field, "rows": len(positions)})
+
+        matched = None
+        if workers != None and workers > 1:
+            matched = self._parallel_positions(positions, predicate, column_tests, vectorized, workers)
+
+        if matched != None:
+            data = self.data
+            result_data = [data[i] for i in matched]
+        elif len(column_tests) == 0 and type(positions) is range:
+            candidates = self.data if len(positions) == len(self.data) else self.data[positions.start:positions.stop]
+            result_data = [row for row in candidates if predicate(row)]
+        else:
+            data = self.data
+            result_data = [data[i] for i in self._matching_positions(positions, predicate, column_tests, vectorized)]
+        plan["stages"].append({"stage": "filter", "rows": len(positions), "matched": len(result_data), "vectorized": vectorized and len(column_tests) > 0, "workers": workers if matched != None else 1})
 
         result = Dataset()
         result.data = result_data
-        result.fields = self.fields
+        result.fields = list(self.fields)
+        result.schema = dict(self.schema)
+        result.encoded_fields = set(self.encoded_fields)
+        result.engine = self.engine
+        self._share_rows(result)
         return result
 
-    def query_one(self, filter_object=None):
-        dataset = self.query(filter_object)
+    def _run_query(self, filter_object, workers):
+        plan = {"operation": "query", "rows": len(self.data), "access": "full scan", "stages": []}
+        start = time.perf_counter()
+        # messages are collected so that each one is printed once per query
+        message_collectors = get_message_collectors()
+        message_collectors.append([])
+        try:
+            result = self._execute_query(filter_object, workers, plan)
+        finally:
+            messages = message_collectors.pop()
+            for message in messages:
+                error_message(message)
+        plan["result_rows"] = len(result.data)
+        plan["seconds"] = time.perf_counter() - start
+        plan["messages"] = messages
+        emit_event(plan)
+        return result, plan
+
+    @cached_result("query")
+    def query(self, filter_object=None, workers=None):
+        return self._run_query(filter_object, workers)[0]
+
+    def explain(self, filter_object=None, workers=None):
+        return self._run_query(filter_object, workers)[1]
+
+    def query_one(self, filter_object=None, workers=None):
+        dataset = self.query(filter_object, workers)
         if len(dataset.data) == 0:
             return dataset
         else:
             dataset.data = [dataset.data[0]]
             return dataset
 
+    @instrumented("select")
+    @cached_result("select")
     def select(self, field_names=None):
         if field_names == None:
             field_names = self.fields
 
         field_ids = self.get_field_ids(field_names)
 
-        selection = copy.deepcopy(self.data)
+        dataset = Dataset()
 
-        for row in selection:
-            for i in reversed(range(len(row))):
-                if not i in field_ids:
-                    row.pop(i)
+        if field_ids == list(range(len(self.fields))):
+            dataset.data = list(self.data)
+            self._share_rows(dataset)
+        elif len(field_ids) == 1:
+            field_id = field_ids[0]
+            dataset.data = [[row[field_id]] for row in self.data]
+        else:
+            dataset.data = [[row[i] for i in field_ids] for row in self.data]
 
-        dataset = Dataset()
         dataset.fields = [self.fields[field_id] for field_id in field_ids]
-        dataset.data = selection
+        dataset.schema = {field: comparison for field, comparison in self.schema.items() if field in dataset.fields}
+        dataset._columns = {field: column for field, column in self._columns.items() if field in dataset.fields}
+        dataset.encoded_fields = set(field for field in self.encoded_fields if field in dataset.fields)
+        dataset._encodings = {field: encoding for field, encoding in self._encodings.items() if field in dataset.fields}
+        dataset.engine = self.engine
         dataset.already_indexed(self.indexed_field, self.indexed_comparison)
+        if self.indexed_field in dataset.fields:
+            dataset._indexed_keys = self._indexed_keys
         return dataset
 
     def select_as(self, field_names=None):
@@ -287,47 +1515,94 @@ class Dataset:
 
         return dataset
 
-    def select_unique(self, field):
-        selection = self.select(field)
+    @instrumented("select_unique")
+    @cached_result("select_unique")
+    def select_unique(self, field_names, count_field=None):
+        if type(field_names) is str:
+            field_names = [field_names]
+        if type(field_names) is not list and type(field_names) is not tuple:
+            error_message("Dataset.select_unique: parameter 'field_names' must be of type 'list' or 'tuple'")
+            return Dataset()
+        field_names = [field for field in field_names if field in self.fields]
+        field_ids = [self.fields.index(field) for field in field_names]
+        if len(field_ids) == 0:
+            error_message("Dataset.select_unique: none of the fields exist, returning empty dataset")
+            return Dataset()
 
-        occurences = []
-        deletions = []
-        for i, row in enumerate(selection.data):
-            if row[0] in occurences:
-                deletions.append(i)
-            else:
-                occurences.append(row[0])
-        for i in reversed(range(len(deletions))):
-            del selection.data[deletions[i]]
-        
+        ordered = len(field_ids) == 1 and field_names[0] == self.indexed_field
+        encodings = [self.encoded_column(field) for field in field_names]
+        counts = None
+        if ordered:
+            try:
+                counts = get_sorted_counts(self.data, field_ids[0], comparison_key(self.indexed_comparison))
+            except ValueError:
+                # values the index's comparison can't key are counted with a hash table instead
+                ordered = False
+        if counts == None and not None in encodings:
+            counts = get_encoded_counts(encodings, count_field != None)
+        elif counts == None:
+            counts = get_counts(self.data, field_ids, count_field != None)
+
+        selection = get_unique_dataset(field_names, counts, count_field)
+        selection.set_schema({field: self.schema[field] for field in field_names if field in self.schema})
+        selection.set_engine(self.engine)
+        if ordered:
+            selection.already_indexed(self.indexed_field, self.indexed_comparison)
         return selection
 
-    def add_field(self, field, derivation=lambda r:""):
-        for row in self.data:
-            r = {f: row[self.fields.index(f)] for f in self.fields}
-            row.append(str(derivation(r)))
+    @instrumented("add_field")
+    def add_field(self, field, derivation=lambda r:"", columns=None, batch=False):
+        values = self._derive(derivation, columns, batch, "add_field")
+        if values == None:
+            fields = self.fields
+            values = [derivation(dict(zip(fields, row))) for row in self.data]
+        elif len(values) != len(self.data):
+            return self
+
+        self._own_rows()
+        self._clear_cache()
+        for row, value in zip(self.data, values):
+            row.append(str(value))
         self.fields.append(field)
         return self
 
     def remove_fields(self, field_names):
         field_ids = self.get_field_ids(field_names)
+        self._own_rows()
+        self._invalidate([self.fields[i] for i in field_ids])
         for x in reversed(range(len(field_ids))):
             i = field_ids[x]
             for row in self.data:
                 del row[i]
+            if self.fields[i] in self.schema:
+                del self.schema[self.fields[i]]
+            if self.fields[i] in self.indexes:
+                del self.indexes[self.fields[i]]
+            self.encoded_fields.discard(self.fields[i])
             del self.fields[i]
         return self
 
     def rename_fields(self, field_names):
-        for i, f in enumerate(self.fields):
-            if f in field_names:
-                if self.fields[i] == self.indexed_field:
-                    self.indexed_field = field_names[f]
-                self.fields[i] = field_names[f]
+        self._clear_cache()
+        # every mapping is rebuilt in one pass, so swapping two names doesn't overwrite either of them
+        renamed = {field: field_names[field] for field in self.fields if field in field_names}
+        rename = lambda field: renamed.get(field, field)
+        if self.indexed_field in renamed:
+            self.indexed_field = renamed[self.indexed_field]
+        self.schema = {rename(field): comparison for field, comparison in self.schema.items()}
+        self._columns = {rename(field): column for field, column in self._columns.items()}
+        self.encoded_fields = set(rename(field) for field in self.encoded_fields)
+        self._encodings = {rename(field): encoding for field, encoding in self._encodings.items()}
+        self.indexes = {rename(field): index for field, index in self.indexes.items()}
+        for field, index in self.indexes.items():
+            index.field = field
+        self.fields = [rename(field) for field in self.fields]
         return self
 
     def replace(self, field_names, function):
         field_ids = self.get_field_ids(field_names)
+        self._own_rows()
+        self._invalidate([self.fields[i] for i in field_ids])
 
         for r, row in enumerate(self.data):
             for i in field_ids:
@@ -335,34 +1610,146 @@ class Dataset:
 
         return self
 
-    def replace_derived(self, field_names, derivation):
+    @instrumented("replace_derived")
+    def replace_derived(self, field_names, derivation, columns=None, batch=False):
         field_ids = self.get_field_ids(field_names)
+        values = self._derive(derivation, columns, batch, "replace_derived")
+        if values != None and len(values) != len(self.data):
+            return self
+        self._own_rows()
+        self._invalidate([self.fields[i] for i in field_ids])
+
+        if values != None:
+            for row, value in zip(self.data, values):
+                value = str(value)
+                for i in field_ids:
+                    row[i] = value
+            return self
 
-        for r, row in enumerate(self.data):
+        # each field is derived from the row as it is after the previous fields were replaced
+        fields = self.fields
+        for row in self.data:
+            r = dict(zip(fields, row))
             for i in field_ids:
-                row[i] = derivation(self.row_to_dict(row))
+                row[i] = derivation(r)
+                r[fields[i]] = row[i]
 
         return self
 
-    def join(self, other_dataset, common_fields, remove=True):
+    @instrumented("join")
+    def join(self, other_dataset, common_fields, remove=True, mode=JoinModes.left):
+        if not mode in (JoinModes.inner, JoinModes.left, JoinModes.outer):
+            error_message(f"Dataset.join: mode \'{mode}\' does not exist, halting join")
+            return self
+
         if type(common_fields) is str:
-            common_fields = [common_fields] * 2
-        for field in other_dataset.fields:
-            if field == common_fields[1]: continue
-            def match(row):
-                matched_row = other_dataset.query_one({
-                    common_fields[1]: row[common_fields[0]]
-                })
-                if matched_row.count() > 0:
-                    return matched_row.to_dictionary()[field]
+            key_pairs = [(common_fields, common_fields)]
+        elif type(common_fields) is dict:
+            key_pairs = list(common_fields.items())
+        elif len(common_fields) == 1 and type(common_fields[0]) is str:
+            key_pairs = [(common_fields[0], common_fields[0])]
+        elif len(common_fields) == 2 and type(common_fields[0]) is str and type(common_fields[1]) is str:
+            key_pairs = [tuple(common_fields)]
+        else:
+            key_pairs = [tuple(pair) for pair in common_fields]
+
+        for own_field, other_field in key_pairs:
+            if not own_field in self.fields:
+                error_message(f"Dataset.join: field \'{own_field}\' does not exist, halting join")
+                return self
+            if not other_field in other_dataset.fields:
+                error_message(f"Dataset.join: field \'{other_field}\' does not exist in 'other_dataset', halting join")
+                return self
+
+        own_key_ids = [self.fields.index(pair[0]) for pair in key_pairs]
+        other_key_ids = [other_dataset.fields.index(pair[1]) for pair in key_pairs]
+        joined_ids = [i for i in range(len(other_dataset.fields)) if not i in other_key_ids]
+        own_key = operator.itemgetter(*own_key_ids)
+        other_key = operator.itemgetter(*other_key_ids)
+        joined_values = operator.itemgetter(*joined_ids) if len(joined_ids) > 0 else lambda row: ()
+        if len(joined_ids) == 1:
+            joined_values = lambda row, i=joined_ids[0]: (row[i],)
+
+        sorted_lookup = len(key_pairs) == 1 and other_dataset.indexed_field == key_pairs[0][1]
+        if sorted_lookup:
+            try:
+                other_dataset._sorted_keys()
+            except ValueError:
+                # a key that can't be compared with the index's comparison leaves the hash table to find the matches
+                sorted_lookup = False
+
+        if sorted_lookup:
+            # the other dataset is sorted on the key, so look matches up with binary searches instead of hashing it
+            other_id = other_key_ids[0]
+            def lookup(key):
+                low, high = other_dataset._equal_range(key)
+                return [row for row in other_dataset.data[low:high] if row[other_id] == key]
+        else:
+            table = {}
+            for row in other_dataset.data:
+                key = other_key(row)
+                if key in table:
+                    table[key].append(row)
                 else:
-                    return ""
-            self.add_field(field, match)
+                    table[key] = [row]
+            lookup = lambda key: table.get(key, ())
+
+        encoding = self.encoded_column(key_pairs[0][0]) if len(key_pairs) == 1 else None
+        if encoding != None:
+            # each distinct value is looked up once, and rows find their matches by code
+            matches_by_code = [lookup(value) for value in encoding.values]
+            row_matches = zip(self.data, map(matches_by_code.__getitem__, encoding.codes))
+        else:
+            row_matches = ((row, lookup(own_key(row))) for row in self.data)
+
+        blanks = [""] * len(joined_ids)
+        matched_keys = set()
+        result_data = []
+        for row, matches in row_matches:
+            if len(matches) == 0:
+                if mode != JoinModes.inner:
+                    result_data.append(row + blanks)
+                continue
+            if mode == JoinModes.outer:
+                matched_keys.add(own_key(row))
+            for match in matches:
+                result_data.append(row + list(joined_values(match)))
+
+        sorted_order = True
+        if mode == JoinModes.outer:
+            for match in other_dataset.data:
+                key = other_key(match)
+                if key in matched_keys:
+                    continue
+                row = [""] * len(self.fields)
+                for own_id, other_id in zip(own_key_ids, other_key_ids):
+                    row[own_id] = match[other_id]
+                result_data.append(row + list(joined_values(match)))
+                sorted_order = False
+
+        self.data = result_data
+        self._shared_rows = False
+        self._invalidate()
+        self.fields = self.fields + [other_dataset.fields[i] for i in joined_ids]
+        if not sorted_order:
+            self.indexed_field = ""
+            self.indexed_comparison = Comparisons.default
 
         if remove:
-            self.remove_fields(common_fields[0])
+            self.remove_fields([pair[0] for pair in key_pairs])
         return self
 
+    def group_by(self, field_names):
+        if type(field_names) is str:
+            field_names = [field_names]
+        if type(field_names) is not list and type(field_names) is not tuple:
+            error_message("Dataset.group_by: parameter 'field_names' must be of type 'list' or 'tuple'")
+            return GroupedDataset(self, [])
+        missing = [field for field in field_names if not field in self.fields]
+        if len(missing) > 0:
+            error_message(f"Dataset.group_by: fields {missing} do not exist, removing from 'field_names'")
+        return GroupedDataset(self, [field for field in field_names if field in self.fields])
+
     def to_dictionary(self):
         if len(self.data) > 1:
             error_message("Dataset.to_dictionary: Not a single-row dataset, using first row")
@@ -382,11 +1769,15 @@ class Dataset:
             array.append(row[0])
         return array
 
+    @cached_result("count")
     def count(self, field_names=None):
         if field_names == None:
             return len(self.data)
 
-        field_ids = self.get_field_ids(field_names)
+        # parsed columns can't hold blank values, so typed fields never make a row null
+        field_ids = [i for i in self.get_field_ids(field_names) if self.typed_column(self.fields[i]) == None]
+        if len(field_ids) == 0:
+            return len(self.data)
 
         n = 0
         for row in self.data:
@@ -400,79 +1791,1090 @@ class Dataset:
         
         return n
 
+    @cached_result("sum")
     def sum(self, field_name=None):
-        values = self.select(field_name).to_list()
-        return sum([float(x) for x in values])
+        values = self._numeric_values(field_name, "sum")
+        if self.engine == Engines.numpy and type(values) is numpy.ndarray:
+            return values.sum().item()
+        return sum(values)
 
+    @cached_result("average")
     def average(self, field_name=None):
-        values = self.select(field_name).to_list()
-        return sum([float(x) for x in values]) / len(values)
-
-    def print_table(self, field_names=None):
-        if field_names != None:
-            self.select(field_names).print_table()
+        values = self._numeric_values(field_name, "average")
+        if self.engine == Engines.numpy and type(values) is numpy.ndarray:
+            return values.mean().item()
+        return sum(values) / len(values)
+
+    def print_table(self, field_names=None, sample=None, output=None):
+        if sample != None and sample < 1:
+            error_message("Dataset.print_table: parameter 'sample' must be at least 1")
             return self
+        fields, rows = project_rows(self.fields, self.data, field_names, "Dataset.print_table")
+        render_table(fields, rows, sample, output)
+        return self
+
+    @instrumented("save_csv")
+    def save_csv(self, filepath, delimiter=",", field_names=None, compression=None):
+        fields, rows = project_rows(self.fields, self.data, field_names, "Dataset.save_csv")
+        write_csv(filepath, fields, rows, delimiter, compression)
+        return self
+
+    @instrumented("save_snapshot")
+    def save_snapshot(self, filepath, source=None, delimiter=","):
+        header = {
+            "fields": self.fields,
+            "rows": len(self.data),
+            "delimiter": delimiter,
+            "source": None if source == None else get_source_info(source),
+            "engine": self.engine,
+            "schema": {},
+            "columns": {},
+            "indexed_field": "",
+            "indexed_comparison": None,
+            "indexes": [],
+            "offsets": [],
+            "blobs": [],
+        }
+        sections = []
 
-        column_widths = []
         for i, field in enumerate(self.fields):
-            max_width = 0
+            cells = [row[i].encode("utf-8") for row in self.data]
+            offsets = array("q", [0])
+            position = 0
+            for cell in cells:
+                position += len(cell)
+                offsets.append(position)
+            sections.append(("offsets", None, offsets.tobytes()))
+            sections.append(("blobs", None, b"".join(cells)))
+
+        for field, comparison in self.schema.items():
+            if comparison.spec == None:
+                error_message(f"Dataset.save_snapshot: the type of \'{field}\' can't be saved, skipping")
+                continue
+            header["schema"][field] = comparison.spec
+            column = self.typed_column(field)
+            if column != None:
+                sections.append(("columns", field, column.tobytes()))
+
+        comparison_spec = getattr(self.indexed_comparison, "spec", None)
+        if self.indexed_field in self.fields and comparison_spec != None:
+            header["indexed_field"] = self.indexed_field
+            header["indexed_comparison"] = comparison_spec
+        elif self.indexed_field in self.fields:
+            error_message(f"Dataset.save_snapshot: the comparison of index \'{self.indexed_field}\' can't be saved, skipping")
+
+        for field, index in self.indexes.items():
+            if type(index) is HashIndex:
+                header["indexes"].append({"field": field, "type": IndexTypes.hash})
+                continue
+            if getattr(index.comparison, "spec", None) == None:
+                error_message(f"Dataset.save_snapshot: the comparison of index \'{field}\' can't be saved, skipping")
+                continue
+            index.build(self)
+            header["indexes"].append({"field": field, "type": IndexTypes.sorted, "comparison": index.comparison.spec})
+            sections.append(("indexes", len(header["indexes"]) - 1, index.order.tobytes()))
+
+        # section offsets are stored in the header, so its size has to be known before they can be filled in
+        def layout(header_length):
+            position = len(snapshot_magic) + 8 + header_length
+            for kind, name, content in sections:
+                position += -position % 8
+                entry = [position, len(content)]
+                if kind in ("offsets", "blobs"):
+                    header[kind].append(entry)
+                elif kind == "columns":
+                    header[kind][name] = entry
+                else:
+                    header[kind][name]["order"] = entry
+                position += len(content)
+
+        header_length = 0
+        while True:
+            header["offsets"], header["blobs"] = [], []
+            layout(header_length)
+            encoded_header = json.dumps(header).encode("utf-8")
+            if len(encoded_header) <= header_length:
+                break
+            header_length = len(encoded_header) + 64
+
+        # the snapshot is replaced rather than rewritten, since datasets loaded from it still have it mapped
+        with open(filepath + ".tmp", "wb") as snapshot_file:
+            snapshot_file.write(snapshot_magic)
+            snapshot_file.write(header_length.to_bytes(8, "little"))
+            snapshot_file.write(encoded_header.ljust(header_length, b" "))
+            position = len(snapshot_magic) + 8 + header_length
+            for kind, name, content in sections:
+                snapshot_file.write(b"\0" * (-position % 8))
+                position += -position % 8
+                snapshot_file.write(content)
+                position += len(content)
+        os.replace(filepath + ".tmp", filepath)
 
-            for row in self.data:
-                width = len(row[i])
-                if width > max_width:
-                    max_width = width
-
-            title_width = len(field)
-            if(title_width > max_width):
-                max_width = title_width
-            
-            column_widths.append(max_width)
-
-        def print_bar(c="-"):
-            print("+", end="")
-            for i in range(len(self.fields)):
-                print("".rjust(column_widths[i]+2, c), end="+")
-            print()
-        
-        def print_row(row, title):
-            if title:
-                print_bar("=")
-            print("|", end="")
-            for i in range(len(self.fields)):
-                adjusted = ""
-                if title:
-                    adjusted = row[i].center(column_widths[i])
+        return self
+
+class GroupedDataset:
+
+    def __init__(self, dataset, field_names):
+        self.dataset = dataset
+        self.fields = list(field_names)
+
+    # sorted data keeps every group contiguous, so groups are found by scanning for the boundaries
+    def _sorted_groups(self, field_id):
+        data = self.dataset.data
+        key = comparison_key(self.dataset.indexed_comparison)
+        labels = []
+        groups = []
+        start = 0
+        while start < len(data):
+            current = key(data[start][field_id])
+            end = start + 1
+            while end < len(data) and not current < key(data[end][field_id]):
+                end += 1
+            values = [data[i][field_id] for i in range(start, end)]
+            # values that compare equal but are written differently ("1" and "1.0") are still separate groups
+            if values.count(values[0]) == len(values):
+                labels.append((values[0],))
+                groups.append(range(start, end))
+            else:
+                run = {}
+                for i, value in zip(range(start, end), values):
+                    run.setdefault(value, []).append(i)
+                labels.extend((value,) for value in run)
+                groups.extend(run.values())
+            start = end
+        return labels, groups
+
+    def _groups(self):
+        dataset = self.dataset
+        data = dataset.data
+        field_ids = [dataset.fields.index(field) for field in self.fields]
+
+        if len(field_ids) == 1 and self.fields[0] == dataset.indexed_field:
+            try:
+                labels, groups = self._sorted_groups(field_ids[0])
+                return labels, groups, True
+            except ValueError:
+                # values the index's comparison can't key are grouped with a hash table instead
+                pass
+
+        encoding = dataset.encoded_column(self.fields[0]) if len(field_ids) == 1 else None
+        if encoding != None:
+            # rows are grouped by code into a list instead of hashing their values
+            code_groups = [[] for _ in encoding.values]
+            for i, code in enumerate(encoding.codes):
+                code_groups[code].append(i)
+            codes = sorted((code for code in range(len(code_groups)) if len(code_groups[code]) > 0), key=lambda code: code_groups[code][0])
+            return [(encoding.values[code],) for code in codes], [code_groups[code] for code in codes], False
+
+        groups = {}
+        if len(field_ids) == 1:
+            field_id = field_ids[0]
+            for i, row in enumerate(data):
+                value = row[field_id]
+                if value in groups:
+                    groups[value].append(i)
                 else:
-                    adjusted = row[i].ljust(column_widths[i])
-                print(" " + adjusted, end=" |")
-            print()
-            if title:
-                print_bar("=")
+                    groups[value] = [i]
+            return [(value,) for value in groups], list(groups.values()), False
+
+        for i, row in enumerate(data):
+            value = tuple([row[field_id] for field_id in field_ids])
+            if value in groups:
+                groups[value].append(i)
             else:
-                print_bar()
-        
-        print()
-        print_row(self.fields, True)
-        for row in self.data:
-            print_row(row, False)
-        print()
+                groups[value] = [i]
+        return list(groups), list(groups.values()), False
+
+    def _aggregate_column(self, aggregation, field, groups):
+        dataset = self.dataset
+        if field == None:
+            if aggregation != Aggregations.count:
+                return None, None
+            return [str(len(group)) for group in groups], Comparisons.integers
+
+        field_id = dataset.fields.index(field)
+        data = dataset.data
+        typed = dataset.typed_column(field)
+        comparison = dataset.schema.get(field) if typed != None else None
+
+        def values(group):
+            if type(group) is range:
+                return column[group.start:group.stop]
+            return [column[i] for i in group]
+
+        if aggregation == Aggregations.count:
+            if typed != None:
+                return [str(len(group)) for group in groups], Comparisons.integers
+            column = [row[field_id] for row in data]
+            return [str(len(group) - values(group).count("")) for group in groups], Comparisons.integers
+
+        if aggregation == Aggregations.distinct_count:
+            column = [row[field_id] for row in data]
+            return [str(len(set(values(group)))) for group in groups], Comparisons.integers
+
+        if aggregation in (Aggregations.minimum, Aggregations.maximum):
+            keys = typed
+            if keys == None:
+                # fields without a type are compared as numbers when they can be, and as strings (like ISO dates) otherwise
+                try:
+                    keys = [float(row[field_id]) for row in data]
+                    comparison = Comparisons.default
+                except ValueError:
+                    keys = [row[field_id] for row in data]
+            pick = min if aggregation == Aggregations.minimum else max
+            results = []
+            for group in groups:
+                position = pick(group, key=keys.__getitem__)
+                results.append(data[position][field_id])
+            return results, comparison if getattr(comparison, "typecode", None) != None else None
+
+        if typed != None:
+            column = typed
+        else:
+            column = [float(row[field_id]) for row in data]
+        if aggregation == Aggregations.sum:
+            return [str(sum(values(group))) for group in groups], comparison if comparison is Comparisons.integers else Comparisons.floats
+        return [str(sum(values(group)) / len(group)) for group in groups], Comparisons.floats
+
+    @instrumented("aggregate")
+    def aggregate(self, aggregations):
+        if type(aggregations) is not dict:
+            error_message("GroupedDataset.aggregate: parameter 'aggregations' must be of type 'dict'")
+            return Dataset()
+
+        dataset = self.dataset
+        valid = (Aggregations.count, Aggregations.sum, Aggregations.average, Aggregations.minimum, Aggregations.maximum, Aggregations.distinct_count)
+        specs = []
+        for output_field, operation in aggregations.items():
+            if operation == Aggregations.count:
+                operation = {Aggregations.count: None}
+            if type(operation) is not dict or len(operation) != 1:
+                error_message(f"GroupedDataset.aggregate: aggregation '{output_field}' must be a dictionary with a single aggregation, skipping")
+                continue
+            aggregation, field = list(operation.items())[0]
+            if not aggregation in valid:
+                error_message(f"GroupedDataset.aggregate: aggregation '{aggregation}' does not exist, skipping")
+                continue
+            if field != None and not field in dataset.fields:
+                error_message(f"GroupedDataset.aggregate: field '{field}' does not exist, skipping")
+                continue
+            if field == None and aggregation != Aggregations.count:
+                error_message(f"GroupedDataset.aggregate: aggregation '{aggregation}' needs a field, skipping")
+                continue
+            specs.append((output_field, aggregation, field))
+
+        labels, groups, ordered = self._groups()
+
+        result = Dataset()
+        result.fields = list(self.fields)
+        columns = []
+        schema = {}
+        for output_field, aggregation, field in specs:
+            try:
+                column, comparison = self._aggregate_column(aggregation, field, groups)
+            except ValueError:
+                error_message(f"GroupedDataset.aggregate: \'{field}\' has non-numeric values, so aggregation '{output_field}' can't be computed, skipping")
+                continue
+            result.fields.append(output_field)
+            columns.append(column)
+            if comparison != None:
+                schema[output_field] = comparison
+
+        result.data = [list(label) for label in labels]
+        for column in columns:
+            for row, value in zip(result.data, column):
+                row.append(value)
+        result.set_schema(schema)
+        result.set_engine(dataset.engine)
+        if ordered:
+            result.already_indexed(dataset.indexed_field, dataset.indexed_comparison)
+        return result
+
+class LazyDataset:
+
+    # UTILITY
+
+    def __init__(self, filepath, delimiter=",", steps=None):
+        self.filepath = filepath
+        self.delimiter = delimiter
+        self.steps = [] if steps == None else steps
+
+    def _then(self, step):
+        return LazyDataset(self.filepath, self.delimiter, self.steps + [step])
+
+    def _pushed_down_steps(self, fields):
+        steps = list(self.steps)
+        for i in range(len(steps)):
+            if steps[i][0] != "query":
+                continue
+            j = i
+            while j > 0:
+                step_fields = [get_step_fields(steps[:j - 1], fields), get_step_fields(steps[:j], fields)]
+                query = push_query_before(steps[j][1], steps[j - 1], step_fields[0], step_fields[1])
+                if query == None:
+                    break
+                steps[j - 1], steps[j] = ("query", query), steps[j - 1]
+                j -= 1
+        return steps
+
+    def _needed_fields(self, steps, fields):
+        needed = set(get_step_fields(steps, fields))
+        for i in reversed(range(len(steps))):
+            step = steps[i]
+            if step[0] == "query":
+                needed |= set(step[1].filter_object)
+            elif step[0] == "select" and step[1] != None:
+                needed |= set(step[1])
+            elif step[0] == "rename":
+                needed = set([old for old, new in step[1].items() if new in needed] + [f for f in needed if not f in step[1].values()])
+            elif step[0] == "replace":
+                needed |= set(step[1])
+            elif step[0] in ("add", "replace_derived"):
+                if step[0] == "replace_derived":
+                    needed |= set(step[1])
+                try:
+                    if step[3] != None:
+                        needed |= set(step[3])
+                    elif type(step[2]) is str:
+                        needed |= set(get_expression_fields(step[2], get_step_fields(steps[:i], fields)))
+                    else:
+                        # derivations receive the whole row, so every field before them is needed
+                        needed = set(get_step_fields(steps[:i], fields))
+                except SyntaxError:
+                    needed = set(get_step_fields(steps[:i], fields))
+        return [field for field in fields if field in needed]
+
+    def _pipeline(self, fields, rows):
+        steps = self._pushed_down_steps(fields)
+        needed = self._needed_fields(steps, fields)
+
+        if len(needed) < len(fields):
+            field_ids = [fields.index(field) for field in needed]
+            rows = ([row[i] for i in field_ids] for row in rows)
+            fields = needed
+
+        for step in steps:
+            fields, rows = apply_step(step, fields, rows)
+        return fields, rows
+
+    def _stream(self):
+        csv_file = open(self.filepath, "r", newline="")
+        csv_reader = csv.reader(csv_file, delimiter=self.delimiter)
+        fields = next(csv_reader, [])
+        fields, rows = self._pipeline(fields, (row for row in csv_reader if row != []))
+
+        def stream():
+            try:
+                for row in rows:
+                    yield row
+            finally:
+                csv_file.close()
+        return fields, stream()
+
+    # USER
+
+    def query(self, filter_object=None):
+        if filter_object == None:
+            return self
+        if type(filter_object) is dict:
+            filter_object = Query(filter_object)
+        elif type(filter_object) is not Query:
+            error_message("LazyDataset.query: parameter 'filter_object' must be of type 'dict' or 'Query'")
+            return self
+        return self._then(("query", filter_object))
+
+    def select(self, field_names=None):
+        if field_names == None:
+            return self._then(("select", None))
+        if type(field_names) is str:
+            field_names = [field_names]
+        return self._then(("select", list(field_names)))
+
+    def select_as(self, field_names=None):
+        if field_names == None:
+            field_names = {}
+        return self.select(list(field_names)).rename_fields(field_names)
+
+    def add_field(self, field, derivation=lambda r:"", columns=None, batch=False):
+        self.steps.append(("add", field, derivation, columns, batch))
+        return self
 
+    def remove_fields(self, field_names):
+        if type(field_names) is str:
+            field_names = [field_names]
+        self.steps.append(("remove", list(field_names)))
+        return self
+
+    def rename_fields(self, field_names):
+        self.steps.append(("rename", dict(field_names)))
+        return self
+
+    def replace(self, field_names, function):
+        if type(field_names) is str:
+            field_names = [field_names]
+        self.steps.append(("replace", list(field_names), function))
+        return self
+
+    def replace_derived(self, field_names, derivation, columns=None, batch=False):
+        if type(field_names) is str:
+            field_names = [field_names]
+        self.steps.append(("replace_derived", list(field_names), derivation, columns, batch))
         return self
 
-    def save_csv(self, filepath, delimiter=",", field_names=None):
-        if field_names != None:
-            self.select(field_names).save_csv(filepath, delimiter)
+    @instrumented("select_unique")
+    def select_unique(self, field_names, count_field=None):
+        fields, rows = self._stream()
+        if type(field_names) is str:
+            field_names = [field_names]
+        field_names = [field for field in field_names if field in fields]
+        if len(field_names) == 0:
+            error_message("LazyDataset.select_unique: none of the fields exist, returning empty dataset")
+            return Dataset()
+        counts = get_counts(rows, [fields.index(field) for field in field_names], count_field != None)
+
+        return get_unique_dataset(field_names, counts, count_field)
+
+    @instrumented("collect")
+    def collect(self, workers=None):
+        if workers != None and workers > 1:
+            fields, rows = read_csv_parallel(self.filepath, self.delimiter, workers, self)
+            if rows != None:
+                dataset = Dataset()
+                dataset.fields = self._pipeline(fields, iter([]))[0]
+                dataset.data = rows
+                return dataset
+
+        fields, rows = self._stream()
+        dataset = Dataset()
+        dataset.fields = fields
+        dataset.data = list(rows)
+        return dataset
+
+    def to_list(self):
+        fields, rows = self._stream()
+        if len(fields) > 1:
+            error_message("LazyDataset.to_list: Not a single-field dataset, using first field")
+        elif len(fields) == 0:
+            error_message("LazyDataset.to_list: Empty dataset, cannot convert dataset to list")
+            return []
+        return [row[0] for row in rows]
+
+    def count(self, field_names=None):
+        fields, rows = self._stream()
+        if field_names == None:
+            return sum(1 for row in rows)
+        field_ids = get_field_ids(fields, field_names)
+        return sum(1 for row in rows if not "" in [row[i] for i in field_ids])
+
+    def _numbers(self, field_name, caller):
+        fields, rows = self._stream()
+        field_ids = get_field_ids(fields, fields if field_name == None else field_name)
+        if len(field_ids) > 1:
+            error_message(f"LazyDataset.{caller}: Not a single-field dataset, using first field")
+        elif len(field_ids) == 0:
+            error_message(f"LazyDataset.{caller}: Empty dataset, cannot get values")
+            return
+        field_id = field_ids[0]
+        for row in rows:
+            yield float(row[field_id])
+
+    def sum(self, field_name=None):
+        return sum(self._numbers(field_name, "sum"))
+
+    def average(self, field_name=None):
+        total = 0
+        n = 0
+        for value in self._numbers(field_name, "average"):
+            total += value
+            n += 1
+        return total / n
+
+    def print_table(self, field_names=None, sample=None, output=None):
+        if sample != None and sample < 1:
+            error_message("LazyDataset.print_table: parameter 'sample' must be at least 1")
             return self
-        
-        csv_file = open(filepath, "w", newline='')
-        csv_writer = csv.writer(csv_file, delimiter=delimiter)
-        csv_writer.writerow(self.fields)
-        csv_writer.writerows(self.data)
-        csv_file.close()
+        fields, rows = self._stream()
+        fields, rows = project_rows(fields, rows, field_names, "LazyDataset.print_table")
+        render_table(fields, rows, sample, output)
+        return self
 
+    @instrumented("save_csv")
+    def save_csv(self, filepath, delimiter=",", field_names=None, compression=None):
+        fields, rows = self._stream()
+        fields, rows = project_rows(fields, rows, field_names, "LazyDataset.save_csv")
+        write_csv(filepath, fields, rows, delimiter, compression)
         return self
 
-def parse_csv(iterator, delimiter=","):
+output_buffer_size = 1 << 20
+output_chunk_size = 4096
+
+# selects fields lazily while the rows are written, instead of copying them with select
+def project_rows(fields, rows, field_names, caller):
+    if field_names == None:
+        return fields, rows
+    if type(field_names) is str:
+        field_names = [field_names]
+    missing = [field for field in field_names if not field in fields]
+    if len(missing) > 0:
+        error_message(f"{caller}: fields {missing} do not exist, skipping")
+    # fields are written in the order of the dataset, like select does
+    field_ids = sorted(fields.index(field) for field in field_names if field in fields)
+    if field_ids == list(range(len(fields))):
+        return fields, rows
+    if len(field_ids) == 1:
+        field_id = field_ids[0]
+        return [fields[field_id]], ([row[field_id]] for row in rows)
+    return [fields[i] for i in field_ids], map(operator.itemgetter(*field_ids), rows)
+
+def open_output(filepath, compression=None):
+    if compression == None and filepath.endswith(".gz"):
+        compression = "gzip"
+    if compression == "gzip":
+        return io.TextIOWrapper(io.BufferedWriter(gzip.open(filepath, "wb", compresslevel=6), output_buffer_size), newline="")
+    if compression != None:
+        error_message(f"save_csv: compression \'{compression}\' is not supported, writing uncompressed")
+    return open(filepath, "w", newline="", buffering=output_buffer_size)
+
+def write_csv(filepath, fields, rows, delimiter=",", compression=None):
+    with open_output(filepath, compression) as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=delimiter)
+        csv_writer.writerow(fields)
+        csv_writer.writerows(rows)
+
+def render_table(fields, rows, sample=None, output=None):
+    if output == None:
+        output = sys.stdout
+    rows = iter(rows)
+    widths = [len(field) for field in fields]
+    chunk = list(rows) if sample == None else list(itertools.islice(rows, sample))
+
+    def bar(c="-"):
+        return "+" + "+".join([c * (width + 2) for width in widths]) + "+\n"
+
+    def line(row, justify):
+        return "| " + " | ".join([justify(value, width) for value, width in zip(row, widths)]) + " |\n"
+
+    first = True
+    while first or len(chunk) > 0:
+        # widths only grow, so a sample decides them until a longer value shows up
+        for i in range(len(fields)):
+            widths[i] = max([widths[i]] + [len(row[i]) for row in chunk])
+        lines = []
+        if first:
+            lines += ["\n", bar("="), line(fields, str.center), bar("=")]
+            first = False
+        separator = bar()
+        for row in chunk:
+            lines.append(line(row, str.ljust))
+            lines.append(separator)
+            if len(lines) >= output_chunk_size:
+                output.write("".join(lines))
+                lines = []
+        output.write("".join(lines))
+        chunk = list(itertools.islice(rows, output_chunk_size if sample == None else sample))
+    output.write("\n")
+
+def get_counts(rows, field_ids, counted=True):
+    if len(field_ids) == 1:
+        field_id = field_ids[0]
+        values = (row[field_id] for row in rows)
+    else:
+        values = (tuple([row[field_id] for field_id in field_ids]) for row in rows)
+    if not counted:
+        return dict.fromkeys(values)
+    counts = {}
+    for value in values:
+        if value in counts:
+            counts[value] += 1
+        else:
+            counts[value] = 1
+    return counts
+
+# counts codes instead of strings, and looks the values of each distinct code up once
+def get_encoded_counts(encodings, counted=True):
+    if len(encodings) == 1:
+        codes = encodings[0].codes
+        values = encodings[0].values
+        decode = values.__getitem__
+    else:
+        codes = zip(*[encoding.codes for encoding in encodings])
+        value_lists = [encoding.values for encoding in encodings]
+        decode = lambda code: tuple([values[c] for values, c in zip(value_lists, code)])
+    if not counted:
+        return dict.fromkeys(map(decode, dict.fromkeys(codes)))
+    return {decode(code): count for code, count in collections.Counter(codes).items()}
+
+def get_unique_dataset(field_names, counts, count_field=None):
+    selection = Dataset()
+    selection.fields = list(field_names)
+    if len(field_names) == 1:
+        selection.data = [[value] for value in counts]
+    else:
+        selection.data = [list(values) for values in counts]
+    if count_field != None:
+        selection.fields.append(count_field)
+        for row, count in zip(selection.data, counts.values()):
+            row.append(str(count))
+        selection.set_schema({count_field: Comparisons.integers})
+    return selection
+
+def get_sorted_counts(rows, field_id, key):
+    # equal values are next to each other, so only a change of value needs a comparison
+    counts = {}
+    run = {}
+    run_key = None
+    last = None
+    for row in rows:
+        value = row[field_id]
+        if value == last:
+            run[value] += 1
+            continue
+        value_key = key(value)
+        if run_key == None or run_key < value_key:
+            counts.update(run)
+            run = {}
+            run_key = value_key
+        run[value] = run.get(value, 0) + 1
+        last = value
+    counts.update(run)
+    return counts
+
+def get_field_ids(fields, field_names):
+    header = Dataset()
+    header.fields = fields
+    return header.get_field_ids(list(field_names) if type(field_names) is not str else field_names)
+
+def get_step_fields(steps, fields):
+    for step in steps:
+        kind = step[0]
+        if kind == "select" and step[1] != None:
+            fields = [field for field in fields if field in step[1]]
+        elif kind == "rename":
+            fields = [step[1].get(field, field) for field in fields]
+        elif kind == "remove":
+            fields = [field for field in fields if not field in step[1]]
+        elif kind == "add":
+            fields = fields + [step[1]]
+    return fields
+
+# returns the query rewritten to run before 'step', or None if moving it would change the result
+def push_query_before(query, step, fields_before, fields_after):
+    filter_fields = set(query.filter_object)
+    kind = step[0]
+    if kind == "query":
+        return None
+    if not filter_fields <= set(fields_after):
+        return None
+    if kind == "select":
+        return query
+    if kind == "remove":
+        return query
+    if kind == "add":
+        return query if not step[1] in filter_fields else None
+    if kind in ("replace", "replace_derived"):
+        return query if len(filter_fields & set(step[1])) == 0 else None
+    if kind == "rename":
+        original_names = {new: old for old, new in step[1].items() if old in fields_before}
+        filter_object = {original_names.get(field, field): operations for field, operations in query.filter_object.items()}
+        if len(filter_object) < len(query.filter_object) or not set(filter_object) <= set(fields_before):
+            return None
+        return Query(filter_object)
+    return None
+
+def apply_step(step, fields, rows):
+    kind = step[0]
+    if kind == "query":
+        index_conditions, predicate, column_tests = step[1]._bind(fields)
+        return fields, filter(predicate, rows)
+    if kind == "select":
+        if step[1] == None:
+            return fields, rows
+        field_ids = get_field_ids(fields, step[1])
+        return [fields[i] for i in field_ids], ([row[i] for i in field_ids] for row in rows)
+    if kind == "remove":
+        field_ids = [i for i, field in enumerate(fields) if not field in step[1]]
+        return [fields[i] for i in field_ids], ([row[i] for i in field_ids] for row in rows)
+    if kind == "rename":
+        return [step[1].get(field, field) for field in fields], rows
+    if kind == "add":
+        return fields + [step[1]], (row + [str(value)] for row, value in derive_rows(fields, rows, step[2], step[3], step[4]))
+    if kind == "replace":
+        field_ids = get_field_ids(fields, step[1])
+        function = step[2]
+        def replaced(rows):
+            for row in rows:
+                for i in field_ids:
+                    row[i] = function(row[i])
+                yield row
+        return fields, replaced(rows)
+    if kind == "replace_derived":
+        field_ids = get_field_ids(fields, step[1])
+        derivation = step[2]
+        def replaced(rows):
+            if type(derivation) is str or step[3] != None:
+                for row, value in derive_rows(fields, rows, derivation, step[3], step[4]):
+                    value = str(value)
+                    for i in field_ids:
+                        row[i] = value
+                    yield row
+                return
+            for row in rows:
+                for i in field_ids:
+                    row[i] = derivation(dict(zip(fields, row)))
+                yield row
+        return fields, replaced(rows)
+    return fields, rows
+
+class LazyRow:
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+class MappedRow(LazyRow):
+
+    def __init__(self, rows, start, end):
+        self._rows = rows
+        self._start = start
+        self._end = end
+        self._cells = None
+
+    def _get_cells(self):
+        if self._cells == None:
+            raw = self._rows.buffer[self._start:self._end]
+            if b'"' in raw:
+                text = raw.decode(self._rows.encoding)
+                self._cells = next(csv.reader(io.StringIO(text, newline=None), delimiter=self._rows.delimiter), [])
+            else:
+                self._cells = raw.split(self._rows.delimiter_bytes)
+        return self._cells
+
+    def __getitem__(self, i):
+        cells = self._get_cells()
+        if type(i) is slice:
+            return [self[j] for j in range(len(cells))[i]]
+        cell = cells[i]
+        if type(cell) is bytes:
+            cell = cell.decode(self._rows.encoding)
+            cells[i] = cell
+        return cell
+
+    def __len__(self):
+        return len(self._get_cells())
+
+class MappedRows:
+
+    def __init__(self, buffer, starts, ends, delimiter, encoding):
+        self.buffer = buffer
+        self.starts = starts
+        self.ends = ends
+        self.delimiter = delimiter
+        self.delimiter_bytes = delimiter.encode(encoding)
+        self.encoding = encoding
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            return [MappedRow(self, self.starts[j], self.ends[j]) for j in range(len(self.starts))[i]]
+        return MappedRow(self, self.starts[i], self.ends[i])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield MappedRow(self, start, end)
+
+def get_line_offsets(buffer, position):
+    starts = array("q")
+    ends = array("q")
+    size = len(buffer)
+
+    if numpy != None and buffer.find(b'"', position) == -1:
+        # without quotes every line break ends a row, so numpy can find them all at once
+        line_breaks = numpy.flatnonzero(numpy.frombuffer(buffer, dtype=numpy.uint8)[position:] == 10) + position
+        line_starts = numpy.concatenate(([position], line_breaks + 1))
+        line_ends = numpy.concatenate((line_breaks, [size]))
+        bytes_view = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        carriage_returns = (line_ends > line_starts) & (bytes_view[numpy.maximum(line_ends - 1, 0)] == 13)
+        line_ends = line_ends - carriage_returns
+        non_empty = line_ends > line_starts
+        starts.frombytes(line_starts[non_empty].astype(numpy.int64).tobytes())
+        ends.frombytes(line_ends[non_empty].astype(numpy.int64).tobytes())
+        return starts, ends
+
+    while position < size:
+        end = buffer.find(b"\n", position)
+        if end == -1:
+            end = size
+        # a line break after an odd number of quotes is inside a quoted value
+        while end < size and buffer[position:end].count(b'"') % 2 == 1:
+            end = buffer.find(b"\n", end + 1)
+            if end == -1:
+                end = size
+        line_end = end
+        if line_end > position and buffer[line_end - 1] == 13:
+            line_end -= 1
+        if line_end > position:
+            starts.append(position)
+            ends.append(line_end)
+        position = end + 1
+    return starts, ends
+
+def map_csv(filepath, delimiter=",", encoding="utf-8"):
+    dataset = Dataset()
+    with open(filepath, "rb") as csv_file:
+        if os.fstat(csv_file.fileno()).st_size == 0:
+            return dataset
+        buffer = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header_end = buffer.find(b"\n")
+    header_end = len(buffer) if header_end == -1 else header_end
+    header = buffer[:header_end].decode(encoding).rstrip("\r")
+    dataset.fields = next(csv.reader([header], delimiter=delimiter), [])
+
+    starts, ends = get_line_offsets(buffer, header_end + 1)
+    dataset.data = MappedRows(buffer, starts, ends, delimiter, encoding)
+    # the rows can't be modified in place, so they are copied into lists before the first modification
+    dataset._shared_rows = True
+    return dataset
+
+snapshot_magic = b"CSVQUERY SNAPSHOT 1\n"
+
+class SnapshotRow(LazyRow):
+
+    def __init__(self, rows, i):
+        self._rows = rows
+        self._i = i
+
+    def __getitem__(self, j):
+        if type(j) is slice:
+            return [self[k] for k in range(len(self))[j]]
+        offsets = self._rows.offsets[j]
+        start = self._rows.blob_starts[j]
+        return str(self._rows.buffer[start + offsets[self._i]:start + offsets[self._i + 1]], "utf-8")
+
+    def __len__(self):
+        return len(self._rows.offsets)
+
+class SnapshotRows:
+
+    def __init__(self, buffer, offsets, blob_starts, length):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.blob_starts = blob_starts
+        self.length = length
+
+    def __getitem__(self, i):
+        if type(i) is slice:
+            return [SnapshotRow(self, j) for j in range(self.length)[i]]
+        if i < 0:
+            i += self.length
+        if i < 0 or i >= self.length:
+            raise IndexError("row index out of range")
+        return SnapshotRow(self, i)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield SnapshotRow(self, i)
+
+def get_file_checksum(filepath):
+    checksum = 0
+    with open(filepath, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b""):
+            checksum = zlib.crc32(block, checksum)
+    return checksum
+
+def get_source_info(filepath, checksum=True):
+    status = os.stat(filepath)
+    info = {"path": os.path.abspath(filepath), "size": status.st_size, "mtime_ns": status.st_mtime_ns}
+    if checksum:
+        info["crc32"] = get_file_checksum(filepath)
+    return info
+
+def is_snapshot_stale(header, source, verify):
+    saved = header.get("source")
+    if saved == None or not os.path.exists(source):
+        return True
+    current = get_source_info(source, verify)
+    if current["size"] != saved["size"] or current["mtime_ns"] != saved["mtime_ns"]:
+        return True
+    return verify and current["crc32"] != saved.get("crc32")
+
+def read_snapshot(filepath):
+    with open(filepath, "rb") as snapshot_file:
+        buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(snapshot_magic)] != snapshot_magic:
+        raise ValueError("not a csvquery snapshot")
+    position = len(snapshot_magic)
+    header_length = int.from_bytes(buffer[position:position + 8], "little")
+    header = json.loads(buffer[position + 8:position + 8 + header_length].decode("utf-8"))
+    return buffer, header
+
+@instrumented("load_snapshot")
+def load_snapshot(filepath, source=None, verify=False):
+    header = None
+    try:
+        buffer, header = read_snapshot(filepath)
+    except (OSError, ValueError) as error:
+        if source == None or not os.path.exists(source):
+            error_message(f"load_snapshot: can't read snapshot \'{filepath}\' ({error})")
+            return None
+
+    if source != None and not os.path.exists(source):
+        # without its source the snapshot can't be rebuilt, so it's used as it is
+        error_message(f"load_snapshot: source \'{source}\' does not exist, loading the snapshot without checking it")
+        source = None
+
+    if source != None and (header == None or is_snapshot_stale(header, source, verify)):
+        return rebuild_snapshot(filepath, source, header)
+
+    def section(entry, typecode):
+        values = array(typecode)
+        values.frombytes(buffer[entry[0]:entry[0] + entry[1]])
+        return values
+
+    dataset = Dataset()
+    dataset.fields = header["fields"]
+    rows = header["rows"]
+    offsets = [memoryview(buffer)[entry[0]:entry[0] + entry[1]].cast("q") for entry in header["offsets"]]
+    dataset.data = SnapshotRows(buffer, offsets, [entry[0] for entry in header["blobs"]], rows)
+    dataset._shared_rows = True
+
+    for field, spec in header["schema"].items():
+        dataset.schema[field] = get_comparison_from_spec(spec)
+    for field, entry in header["columns"].items():
+        dataset._columns[field] = section(entry, dataset.schema[field].typecode)
+    if header["indexed_field"] != "":
+        dataset.already_indexed(header["indexed_field"], get_comparison_from_spec(header["indexed_comparison"]))
+    for index in header["indexes"]:
+        if index["type"] == IndexTypes.hash:
+            dataset.indexes[index["field"]] = HashIndex(index["field"])
+        else:
+            sorted_index = SortedIndex(index["field"], get_comparison_from_spec(index["comparison"]))
+            sorted_index.order = section(index["order"], "q")
+            dataset.indexes[index["field"]] = sorted_index
+    dataset.set_engine(header.get("engine", Engines.python))
+    return dataset
+
+def rebuild_snapshot(filepath, source, header=None):
+    if header == None:
+        header = {"delimiter": ",", "schema": {}, "indexed_field": "", "indexes": []}
+    dataset = open_csv(source, header["delimiter"], {field: get_comparison_from_spec(spec) for field, spec in header["schema"].items()})
+    if header["indexed_field"] != "":
+        dataset.index(header["indexed_field"], get_comparison_from_spec(header["indexed_comparison"]))
+    for index in header["indexes"]:
+        if index["type"] == IndexTypes.hash:
+            dataset.add_index(index["field"], IndexTypes.hash)
+        else:
+            dataset.add_index(index["field"], IndexTypes.sorted, get_comparison_from_spec(index["comparison"]))
+    return dataset.save_snapshot(filepath, source, header["delimiter"])
+
+parallel_tasks = {}
+parallel_task_ids = itertools.count()
+
+def get_process_pool(workers, inherit=False):
+    # the workers can only use the state of parallel_tasks (and the functions inside it) if they are forked
+    if "fork" in multiprocessing.get_all_start_methods():
+        return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    if inherit:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(workers)
+
+def split_positions(positions, parts):
+    size = max(1, math.ceil(len(positions) / parts))
+    return [positions[i:i + size] for i in range(0, len(positions), size)]
+
+def run_query_task(task_id, positions):
+    dataset, predicate, column_tests, vectorized = parallel_tasks[task_id]
+    return dataset._matching_positions(positions, predicate, column_tests, vectorized)
+
+def count_quotes(csv_file, start, end):
+    csv_file.seek(start)
+    quotes = 0
+    while start < end:
+        block = csv_file.read(min(1 << 20, end - start))
+        if block == b"":
+            break
+        quotes += block.count(b'"')
+        start += len(block)
+    return quotes
+
+# chunks end on line breaks outside of quotes, so a value with a line break inside it is never split
+def get_byte_chunks(filepath, parts):
+    size = os.path.getsize(filepath)
+    with open(filepath, "rb") as csv_file:
+        header = csv_file.readline()
+        while header.count(b'"') % 2 == 1 and csv_file.tell() < size:
+            header += csv_file.readline()
+        bounds = [csv_file.tell()]
+        for i in range(1, parts):
+            target = max(bounds[-1], size * i // parts)
+            quotes = count_quotes(csv_file, bounds[-1], target)
+            csv_file.seek(target)
+            line = csv_file.readline()
+            quotes += line.count(b'"')
+            while quotes % 2 == 1 and line != b"":
+                line = csv_file.readline()
+                quotes += line.count(b'"')
+            bounds.append(max(bounds[-1], csv_file.tell()))
+        bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
+
+def run_scan_task(task_id, filepath, delimiter, start, end):
+    with open(filepath, "rb") as csv_file:
+        csv_file.seek(start)
+        chunk = csv_file.read(end - start)
+    rows = (row for row in csv.reader(io.TextIOWrapper(io.BytesIO(chunk), encoding="utf-8", newline=""), delimiter=delimiter) if row != [])
+    if task_id != None:
+        lazy_dataset, fields = parallel_tasks[task_id]
+        rows = lazy_dataset._pipeline(fields, rows)[1]
+    return list(rows)
+
+def read_csv_parallel(filepath, delimiter, workers, lazy_dataset=None):
+    with open(filepath, "r", encoding="utf-8", newline="") as csv_file:
+        fields = next(csv.reader(csv_file, delimiter=delimiter), [])
+
+    pool = get_process_pool(workers, lazy_dataset != None)
+    if pool == None:
+        error_message("read_csv_parallel: parallel pipelines need the 'fork' start method, running on one core")
+        return fields, None
+
+    task_id = None
+    if lazy_dataset != None:
+        task_id = next(parallel_task_ids)
+        parallel_tasks[task_id] = (lazy_dataset, fields)
+    try:
+        with pool:
+            # more chunks than workers, so a slow chunk doesn't leave the other cores idle
+            chunks = get_byte_chunks(filepath, workers * 4)
+            tasks = [pool.submit(run_scan_task, task_id, filepath, delimiter, start, end) for start, end in chunks]
+            rows = []
+            for task in tasks:
+                rows.extend(task.result())
+    finally:
+        if task_id != None:
+            del parallel_tasks[task_id]
+    return fields, rows
+
+@instrumented("parse_csv")
+def parse_csv(iterator, delimiter=",", schema=None):
     if type(iterator) is str:
         iterator = iterator.split("\n")
     dataset = Dataset()
@@ -484,17 +2886,431 @@ def parse_csv(iterator, delimiter=","):
             continue
         else:
             dataset.data.append(row)
+    if schema != None:
+        dataset.set_schema(schema)
+    return dataset
+
+def follow_csv(filepath, delimiter=",", schema=None, encoding="utf-8"):
+    dataset = Dataset()
+    dataset._followed_file = {"path": filepath, "delimiter": delimiter, "encoding": encoding, "offset": 0}
+    dataset.refresh()
+    if schema != None:
+        dataset.set_schema(schema)
     return dataset
 
-def open_csv(filepath, delimiter=","):
+@instrumented("open_csv")
+def open_csv(filepath, delimiter=",", schema=None, workers=None, mapped=False):
+    if mapped:
+        dataset = map_csv(filepath, delimiter)
+        if schema != None:
+            dataset.set_schema(schema)
+        return dataset
+
+    if workers != None and workers > 1:
+        dataset = Dataset()
+        dataset.fields, dataset.data = read_csv_parallel(filepath, delimiter, workers)
+        if schema != None:
+            dataset.set_schema(schema)
+        return dataset
+
     csv_file = open(filepath, "r")
-    dataset = parse_csv(csv_file, delimiter)
+    dataset = parse_csv(csv_file, delimiter, schema)
     csv_file.close()
     return dataset
 
-def get_csv(url, delimiter=","):
-    text = requests.get(url=url).text
-    return parse_csv(text.split("\n"))
+def scan_csv(filepath, delimiter=","):
+    return LazyDataset(filepath, delimiter)
+
+zone_block_size = 16384
+
+def get_zone_spec(comparison):
+    spec = getattr(comparison, "spec", None)
+    return spec if type(spec) in (str, list) else None
+
+# yields each row of a file with the byte offset where the row after it starts
+def read_rows_with_offsets(filepath, delimiter, encoding):
+    with open(filepath, "rb") as csv_file:
+        offset = [0]
+        def lines():
+            for line in csv_file:
+                offset[0] += len(line)
+                yield line.decode(encoding)
+        for row in csv.reader(lines(), delimiter=delimiter):
+            yield row, offset[0]
+
+# splits a file into blocks of rows and records the smallest and largest key of each zone field in each block
+def get_zone_map(filepath, delimiter, encoding, zone_comparisons, block_size):
+    rows = read_rows_with_offsets(filepath, delimiter, encoding)
+    fields, start = next(rows, ([], 0))
+    keys = [(field, fields.index(field), zone_comparisons[field].key) for field in zone_comparisons if field in fields]
+    blocks = []
+    block = None
+    for row, end in rows:
+        if row == []:
+            if block == None:
+                start = end
+            continue
+        if block == None:
+            block = {"start": start, "end": end, "rows": 0, "zones": {field: [] for field, _, _ in keys}}
+            blocks.append(block)
+        block["end"] = end
+        block["rows"] += 1
+        zones = block["zones"]
+        for field, field_id, key in keys:
+            zone = zones[field]
+            if zone == None:
+                continue
+            try:
+                value = key(row[field_id])
+            except (ValueError, IndexError):
+                # a block with a value that can't be decoded can never be skipped
+                zones[field] = None
+                continue
+            if len(zone) == 0:
+                zone.extend((value, value))
+            elif value < zone[0]:
+                zone[0] = value
+            elif value > zone[1]:
+                zone[1] = value
+        if block["rows"] == block_size:
+            block = None
+            start = end
+    return fields, blocks
+
+def merge_zones(blocks, field):
+    zones = [block["zones"].get(field) for block in blocks]
+    if any(zone == None for zone in zones):
+        return None
+    zones = [zone for zone in zones if len(zone) > 0]
+    if len(zones) == 0:
+        return []
+    return [min(zone[0] for zone in zones), max(zone[1] for zone in zones)]
+
+# returns (field, operator, key) conditions of a query that can be checked against the smallest and largest keys
+def get_zone_conditions(query, schema, zone_comparisons):
+    conditions = []
+    for field, operations in query.filter_object.items():
+        zone_comparison = zone_comparisons.get(field)
+        if zone_comparison == None:
+            continue
+        operations = dict(operations)
+        comparison = operations.pop(Operators.comparison, None) or schema.get(field)
+        for operator, value in operations.items():
+            if comparison != None:
+                usable = comparison is zone_comparison or (get_zone_spec(comparison) != None and get_zone_spec(comparison) == get_zone_spec(zone_comparison))
+            elif operator in (Operators.equal, Operators.inside):
+                # without a comparison, "eq" and "in" compare the strings themselves
+                usable = get_zone_spec(zone_comparison) == "strings"
+            else:
+                usable = zone_comparison is Comparisons.default
+            if not usable or not operator in zone_operators:
+                continue
+            key = zone_comparison.key
+            try:
+                if operator == Operators.inside:
+                    if not type(value) in (list, tuple, set):
+                        continue
+                    conditions.append((field, operator, [key(str(v)) for v in value]))
+                else:
+                    conditions.append((field, operator, key(str(value))))
+            except (ValueError, TypeError):
+                continue
+    return conditions
+
+zone_operators = {
+    Operators.equal                 :   lambda low, high, v: low <= v <= high,
+    Operators.inside                :   lambda low, high, v: any(low <= x <= high for x in v),
+    Operators.greater_than          :   lambda low, high, v: high > v,
+    Operators.greater_than_or_equal :   lambda low, high, v: high >= v,
+    Operators.less_than             :   lambda low, high, v: low < v,
+    Operators.less_than_or_equal    :   lambda low, high, v: low <= v,
+}
+
+def zones_may_match(zones, conditions):
+    for field, operator, value in conditions:
+        zone = zones.get(field)
+        if zone == None:
+            continue
+        if len(zone) == 0 or not zone_operators[operator](zone[0], zone[1], value):
+            return False
+    return True
+
+def run_partition_task(filepath, delimiter, encoding, ranges):
+    rows = []
+    with open(filepath, "rb") as csv_file:
+        for start, end in ranges:
+            csv_file.seek(start)
+            chunk = csv_file.read(end - start).decode(encoding)
+            rows.extend(row for row in csv.reader(io.StringIO(chunk, newline=""), delimiter=delimiter) if row != [])
+    return rows
+
+class PartitionedDataset:
+
+    # UTILITY
+
+    def __init__(self, filepaths, delimiter=",", schema=None, zone_fields=None, block_size=zone_block_size, catalog=None, encoding="utf-8"):
+        self.filepaths = filepaths
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.schema = {} if schema == None else dict(schema)
+        self.block_size = block_size
+        self.catalog = catalog
+        self.fields = []
+        self.partitions = []
+        self.zone_comparisons = {}
+        for field in (list(self.schema) if zone_fields == None else zone_fields):
+            comparison = self.schema.get(field, Comparisons.strings)
+            if getattr(comparison, "key", None) == None:
+                error_message(f"PartitionedDataset: comparison of \'{field}\' has no key, so its values can't be summarized, skipping")
+                continue
+            self.zone_comparisons[field] = comparison
+        self.refresh()
+
+    def _get_files(self):
+        if os.path.isdir(self.filepaths):
+            return sorted(os.path.join(self.filepaths, name) for name in os.listdir(self.filepaths) if name.endswith(".csv") or name.endswith(".CSV"))
+        return sorted(glob.glob(self.filepaths))
+
+    def _read_catalog(self):
+        if self.catalog == None:
+            return {}
+        try:
+            with open(self.catalog, "r") as catalog_file:
+                saved = json.load(catalog_file)
+        except (OSError, ValueError):
+            return {}
+        settings = [saved.get("delimiter"), saved.get("encoding"), saved.get("block_size"), saved.get("zones")]
+        # zones of comparisons without a spec can't be told apart from the zones of another comparison
+        if settings != [self.delimiter, self.encoding, self.block_size, self._zone_specs()] or None in self._zone_specs().values():
+            return {}
+        return {partition["path"]: partition for partition in saved.get("partitions", [])}
+
+    def _write_catalog(self):
+        try:
+            with open(self.catalog, "w") as catalog_file:
+                json.dump({
+                    "delimiter": self.delimiter,
+                    "encoding": self.encoding,
+                    "block_size": self.block_size,
+                    "zones": self._zone_specs(),
+                    "partitions": self.partitions
+                }, catalog_file)
+        except OSError as error:
+            error_message(f"PartitionedDataset: catalog \'{self.catalog}\' can't be written ({error})")
+
+    def _zone_specs(self):
+        return {field: get_zone_spec(comparison) for field, comparison in self.zone_comparisons.items()}
+
+    def _plan(self, filter_object):
+        query = filter_object if type(filter_object) is Query else Query(filter_object)
+        if query.filter_object == None:
+            return None, None
+        conditions = get_zone_conditions(query, self.schema, self.zone_comparisons)
+        tasks = []
+        plan = {"files": len(self.partitions), "files_read": 0, "blocks": 0, "blocks_read": 0}
+        for partition in self.partitions:
+            plan["blocks"] += len(partition["blocks"])
+            if not zones_may_match(partition["zones"], conditions):
+                continue
+            ranges = []
+            for block in partition["blocks"]:
+                if not zones_may_match(block["zones"], conditions):
+                    continue
+                plan["blocks_read"] += 1
+                # neighbouring blocks are read in one go
+                if len(ranges) > 0 and ranges[-1][1] == block["start"]:
+                    ranges[-1][1] = block["end"]
+                else:
+                    ranges.append([block["start"], block["end"]])
+            if len(ranges) > 0:
+                plan["files_read"] += 1
+                tasks.append((partition, ranges))
+        return tasks, plan
+
+    def _load(self, tasks, workers):
+        pool = None
+        if workers != None and workers > 1 and len(tasks) > 1:
+            pool = get_process_pool(workers)
+        if pool == None:
+            results = [run_partition_task(p["path"], self.delimiter, self.encoding, ranges) for p, ranges in tasks]
+        else:
+            with pool:
+                futures = [pool.submit(run_partition_task, p["path"], self.delimiter, self.encoding, ranges) for p, ranges in tasks]
+                results = [future.result() for future in futures]
+
+        dataset = Dataset()
+        dataset.fields = list(self.fields)
+        for (partition, _), rows in zip(tasks, results):
+            if partition["fields"] != self.fields:
+                # files with the same fields in another order are rearranged
+                field_ids = [partition["fields"].index(field) for field in self.fields]
+                rows = [[row[i] for i in field_ids] for row in rows]
+            dataset.data.extend(rows)
+        return dataset.set_schema(self.schema)
+
+    # USER METHODS
+
+    def refresh(self):
+        saved = self._read_catalog()
+        known = {partition["path"]: partition for partition in self.partitions}
+        self.partitions = []
+        self.fields = []
+        changed = False
+        for filepath in self._get_files():
+            info = get_source_info(filepath, False)
+            partition = known.get(info["path"]) or saved.get(info["path"])
+            if partition == None or partition["size"] != info["size"] or partition["mtime_ns"] != info["mtime_ns"]:
+                try:
+                    fields, blocks = get_zone_map(filepath, self.delimiter, self.encoding, self.zone_comparisons, self.block_size)
+                except (OSError, UnicodeDecodeError, csv.Error) as error:
+                    error_message(f"PartitionedDataset.refresh: \'{filepath}\' can't be read ({error}), skipping")
+                    continue
+                partition = dict(info, fields=fields, blocks=blocks, zones={field: merge_zones(blocks, field) for field in self.zone_comparisons})
+                changed = True
+            if len(self.fields) == 0:
+                self.fields = list(partition["fields"])
+            elif sorted(partition["fields"]) != sorted(self.fields):
+                error_message(f"PartitionedDataset.refresh: fields of \'{filepath}\' don't match the fields of the other files, skipping")
+                continue
+            self.partitions.append(partition)
+        if self.catalog != None and (changed or len(saved) != len(self.partitions)):
+            self._write_catalog()
+        return self
+
+    def query(self, filter_object=None, workers=None):
+        return self._run_query(filter_object, workers)[0]
+
+    def explain(self, filter_object=None, workers=None):
+        return self._run_query(filter_object, workers)[1]
+
+    def _run_query(self, filter_object, workers):
+        tasks, partition_plan = self._plan(filter_object)
+        if tasks == None:
+            return Dataset(), {}
+        result, plan = self._load(tasks, workers)._run_query(filter_object, None)
+        plan.update(partition_plan)
+        return result, plan
+
+    def collect(self, workers=None):
+        return self._load([(partition, [[block["start"], block["end"]] for block in partition["blocks"]]) for partition in self.partitions], workers)
+
+    def count(self):
+        return sum(block["rows"] for partition in self.partitions for block in partition["blocks"])
+
+@instrumented("open_partitioned")
+def open_partitioned(path, delimiter=",", schema=None, zone_fields=None, block_size=zone_block_size, catalog=None, encoding="utf-8"):
+    return PartitionedDataset(path, delimiter, schema, zone_fields, block_size, catalog, encoding)
+
+download_chunk_size = 1 << 16
+
+def get_cache_paths(cache, url):
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache, name + ".csv"), os.path.join(cache, name + ".json")
+
+def read_cache_info(info_path):
+    try:
+        with open(info_path, "r") as info_file:
+            return json.load(info_file)
+    except (OSError, ValueError):
+        return None
+
+def get_response_encoding(response):
+    # requests assumes ISO-8859-1 for any text response without a charset, but CSV feeds are nearly always UTF-8
+    if "charset" in response.headers.get("content-type", "").lower() and response.encoding != None:
+        return response.encoding
+    return "utf-8"
+
+def stream_lines(chunks, encoding, cache_file=None):
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        if cache_file != None:
+            cache_file.write(chunk)
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", True)
+    if pending != "":
+        yield pending
+
+def read_cached_csv(data_path, cached, delimiter, schema):
+    with open(data_path, "r", encoding=cached["encoding"], newline="") as csv_file:
+        return parse_csv(csv_file, delimiter, schema)
+
+def download_csv(url, delimiter, schema, cache, session, timeout, cached):
+    headers = {}
+    if cached != None and cached.get("etag") != None:
+        headers["If-None-Match"] = cached["etag"]
+    if cached != None and cached.get("last_modified") != None:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with (requests if session == None else session).get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304 and cached != None:
+            return read_cached_csv(cached["path"], cached, delimiter, schema)
+        if response.status_code >= 400:
+            error_message(f"get_csv: \'{url}\' returned status {response.status_code}, returning empty dataset")
+            return Dataset()
+
+        encoding = get_response_encoding(response)
+        chunks = response.iter_content(download_chunk_size)
+        validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        if cache == None or validators == {"etag": None, "last_modified": None}:
+            return parse_csv(stream_lines(chunks, encoding), delimiter, schema)
+
+        # the body is written to the cache while it's parsed, and only replaces the old copy once it's complete
+        data_path, info_path = get_cache_paths(cache, url)
+        os.makedirs(cache, exist_ok=True)
+        with open(data_path + ".part", "wb") as cache_file:
+            dataset = parse_csv(stream_lines(chunks, encoding, cache_file), delimiter, schema)
+        os.replace(data_path + ".part", data_path)
+        with open(info_path, "w") as info_file:
+            json.dump(dict(validators, url=url, encoding=encoding), info_file)
+        return dataset
+
+@instrumented("get_csv")
+def get_csv(url, delimiter=",", schema=None, cache=None, session=None, timeout=60):
+    cached = None
+    if cache != None:
+        data_path, info_path = get_cache_paths(cache, url)
+        cached = read_cache_info(info_path) if os.path.exists(data_path) else None
+        if cached != None:
+            cached["path"] = data_path
+
+    try:
+        return download_csv(url, delimiter, schema, cache, session, timeout, cached)
+    except requests.RequestException as error:
+        if cached != None:
+            error_message(f"get_csv: can't download \'{url}\' ({error}), using the cached copy")
+            return read_cached_csv(cached["path"], cached, delimiter, schema)
+        error_message(f"get_csv: can't download \'{url}\' ({error}), returning empty dataset")
+        return Dataset()
+
+async def get_csvs_async(urls, delimiter=",", schema=None, cache=None, connections=8, timeout=60):
+    # requests.Session isn't thread-safe, so each worker thread gets its own
+    sessions = []
+    thread_state = threading.local()
+
+    def get_thread_csv(url):
+        if not hasattr(thread_state, "session"):
+            thread_state.session = requests.Session()
+            sessions.append(thread_state.session)
+        return get_csv(url, delimiter, schema, cache, thread_state.session, timeout)
+
+    loop = asyncio.get_running_loop()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=connections) as executor:
+            downloads = [loop.run_in_executor(executor, get_thread_csv, url) for url in urls]
+            return list(await asyncio.gather(*downloads))
+    finally:
+        for session in sessions:
+            session.close()
 
 def error_message(msg):
+    message_collectors = get_message_collectors()
+    if len(message_collectors) > 0:
+        if not msg in message_collectors[-1]:
+            message_collectors[-1].append(msg)
+        return
+    logger.error(msg)
     print("[csvquery] ERROR: "+msg)
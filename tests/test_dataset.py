@@ -0,0 +1,200 @@
+import io, os, random, sys, tempfile, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from csvquery import parse_csv, open_csv, scan_csv, follow_csv, Comparisons, JoinModes, IndexTypes
+
+class JoinTest(unittest.TestCase):
+
+    def test_indexed_key_that_cant_be_compared(self):
+        names = parse_csv("id,name\n2,B\n,C\n1,A")
+        names.already_indexed("id")
+        rows = parse_csv("value,id\nx,1\ny,2")
+        self.assertEqual(rows.select().join(names, "id", mode=JoinModes.inner).data, [["x", "A"], ["y", "B"]])
+        self.assertEqual(rows.select().join(names, "id").data, [["x", "A"], ["y", "B"]])
+
+    def test_indexed_key(self):
+        names = parse_csv("id,name\n1,A\n2,B\n2,C").index("id", Comparisons.integers)
+        rows = parse_csv("value,id\nx,2\ny,\nz,1")
+        self.assertEqual(rows.join(names, "id").data, [["x", "B"], ["x", "C"], ["y", ""], ["z", "A"]])
+
+class CacheTest(unittest.TestCase):
+
+    def test_query_passes_workers(self):
+        dataset = parse_csv("a,b\n1,x\n2,y")
+        Dataset = type(dataset)
+        calls = []
+        run_query = Dataset._run_query
+        def recorded(self, filter_object, workers):
+            calls.append(workers)
+            return run_query(self, filter_object, workers)
+
+        with mock.patch.object(Dataset, "_run_query", recorded):
+            dataset.query({"a": "1"}, workers=4)
+            dataset.set_cache()
+            dataset.query({"a": "2"}, workers=4)
+            dataset.query({"a": "3"}, 4)
+            cached = dataset.query({"a": "3"}, workers=2)
+        self.assertEqual(calls, [4, 4, 4])
+        self.assertEqual(cached.data, [])
+        self.assertEqual(dataset.cache_stats()["hits"], 1)
+
+class SelectUniqueTest(unittest.TestCase):
+
+    def test_indexed_field_that_cant_be_compared(self):
+        dataset = parse_csv("a\na\nb\na").already_indexed("a")
+        self.assertEqual(dataset.select_unique("a").data, [["a"], ["b"]])
+        self.assertEqual(dataset.select_unique("a", "count").data, [["a", "2"], ["b", "1"]])
+
+    def test_indexed_field(self):
+        dataset = parse_csv("a\n3\n1\n2\n1").index("a", Comparisons.integers)
+        self.assertEqual(dataset.select_unique("a", "count").data, [["1", "2"], ["2", "1"], ["3", "1"]])
+
+class GroupByTest(unittest.TestCase):
+
+    def test_indexed_field_that_cant_be_compared(self):
+        dataset = parse_csv("a,n\na,1\nb,2\na,3").already_indexed("a")
+        result = dataset.group_by("a").aggregate({"rows": "count", "total": {"sum": "n"}})
+        self.assertEqual(result.data, [["a", "2", "4.0"], ["b", "1", "2.0"]])
+        self.assertEqual(result.indexed_field, "")
+
+    def test_min_max_of_strings(self):
+        dataset = parse_csv("a,date\nx,2020-01-02\nx,2020-01-01\ny,2020-02-01")
+        result = dataset.group_by("a").aggregate({"first": {"min": "date"}, "last": {"max": "date"}})
+        self.assertEqual(result.data, [["x", "2020-01-01", "2020-01-02"], ["y", "2020-02-01", "2020-02-01"]])
+
+class OrderByTest(unittest.TestCase):
+
+    def test_descending_of_wrong_length(self):
+        dataset = parse_csv("a,b\n1,x\n2,y")
+        with mock.patch("builtins.print") as printed:
+            self.assertEqual(dataset.order_by(["a", "b"], descending=[]).data, [])
+            self.assertEqual(dataset.order_by(["a", "b"], descending=[True]).data, [])
+        self.assertEqual(printed.call_count, 2)
+
+    def test_descending_of_missing_field(self):
+        dataset = parse_csv("a,b\n1,x\n2,y\n2,z", schema={"a": Comparisons.integers})
+        with mock.patch("builtins.print"):
+            result = dataset.order_by(["c", "a", "b"], descending=[False, True, True], comparisons={"b": Comparisons.strings})
+        self.assertEqual(result.data, [["2", "z"], ["2", "y"], ["1", "x"]])
+
+class PrintTableTest(unittest.TestCase):
+
+    def test_sample_below_one(self):
+        dataset = parse_csv("a,b\n1,x\n22,y")
+        for sample in (0, -1):
+            output = io.StringIO()
+            with mock.patch("builtins.print") as printed:
+                self.assertIs(dataset.print_table(sample=sample, output=output), dataset)
+            self.assertEqual(output.getvalue(), "")
+            self.assertEqual(printed.call_count, 1)
+
+    def test_lazy_sample_below_one(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "data.csv")
+            with open(path, "w") as csv_file:
+                csv_file.write("a,b\n1,x\n22,y\n")
+            output = io.StringIO()
+            with mock.patch("builtins.print") as printed:
+                scan_csv(path).print_table(sample=0, output=output)
+            self.assertEqual(output.getvalue(), "")
+            self.assertEqual(printed.call_count, 1)
+            scan_csv(path).print_table(sample=1, output=output)
+        self.assertIn("| 22 | y |", output.getvalue())
+
+class RenameFieldsTest(unittest.TestCase):
+
+    def test_swap(self):
+        dataset = parse_csv("a,b\n1,2.5\n2,0.5", schema={"a": Comparisons.integers, "b": Comparisons.floats})
+        dataset.add_index("a", IndexTypes.hash)
+        dataset.typed_column("a")
+        dataset.typed_column("b")
+        dataset.rename_fields({"a": "b", "b": "a"})
+        self.assertEqual(dataset.fields, ["b", "a"])
+        self.assertIs(dataset.schema["a"], Comparisons.floats)
+        self.assertIs(dataset.schema["b"], Comparisons.integers)
+        self.assertEqual(list(dataset.typed_column("a")), [2.5, 0.5])
+        self.assertEqual(list(dataset.typed_column("b")), [1, 2])
+        self.assertEqual(dataset.indexes["b"].field, "b")
+        self.assertEqual(dataset.query({"b": "2"}).data, [["2", "0.5"]])
+        self.assertEqual(dataset.query({"a": {"gt": 1}}).data, [["1", "2.5"]])
+
+class AppendRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        generator = random.Random(0)
+        self.rows = [[str(generator.randrange(100)), "city_" + str(generator.randrange(5)), str(generator.randrange(50))] for i in range(300)]
+
+    def make(self, rows):
+        dataset = parse_csv("key,city,value", schema={"key": Comparisons.integers, "value": Comparisons.integers})
+        dataset.data = [list(row) for row in rows]
+        return dataset
+
+    def indexed(self, rows):
+        dataset = self.make(rows).index("key", Comparisons.integers)
+        dataset.add_index("city", IndexTypes.hash)
+        dataset.add_index("value", IndexTypes.sorted, Comparisons.integers)
+        return dataset
+
+    def assert_same_queries(self, dataset, expected):
+        for filter_object in [{"key": {"gte": 20, "lt": 40}}, {"city": "city_3"}, {"city": {"in": ["city_1", "city_4"]}}, {"value": {"gt": 30}}, {"value": 7, "city": "city_2"}]:
+            self.assertEqual(sorted(dataset.query(filter_object).data), sorted(expected.query(filter_object).data), filter_object)
+
+    def test_merge_in_the_middle(self):
+        dataset = self.indexed(self.rows[:200])
+        dataset.query({"city": "city_1"})
+        dataset.query({"value": {"gt": 10}})
+        for start in range(200, 300, 25):
+            dataset.append_rows(self.rows[start:start + 25])
+        expected = self.make(self.rows).index("key", Comparisons.integers)
+        self.assertEqual(dataset.data, expected.data)
+        self.assertEqual(list(dataset.typed_column("value")), [int(row[2]) for row in expected.data])
+        self.assertIsNotNone(dataset.indexes["city"].buckets)
+        self.assertIsNotNone(dataset.indexes["value"].keys)
+        self.assert_same_queries(dataset, expected)
+
+    def test_append_after_the_last_key(self):
+        dataset = self.indexed(self.rows)
+        dataset.query({"city": "city_1"})
+        new_rows = [[str(100 + i), "city_" + str(i % 5), str(i)] for i in range(10)]
+        dataset.append_rows(new_rows)
+        self.assertEqual(dataset.data[-10:], new_rows)
+        self.assert_same_queries(dataset, self.make(self.rows + new_rows))
+
+    def test_unindexed(self):
+        dataset = self.make(self.rows[:100])
+        dataset.add_index("city", IndexTypes.hash)
+        dataset.query({"city": "city_1"})
+        dataset.append_rows(self.rows[100:])
+        self.assertEqual(dataset.data, self.rows)
+        self.assert_same_queries(dataset, self.make(self.rows))
+
+    def test_rows_with_wrong_length(self):
+        dataset = self.make([])
+        dataset.append_rows([["1", "a", "2"], ["1", "a"]])
+        self.assertEqual(dataset.data, [["1", "a", "2"]])
+
+class FollowCsvTest(unittest.TestCase):
+
+    def test_partial_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "log.csv")
+            with open(path, "w", newline="") as csv_file:
+                csv_file.write("time,message\n1,start\n2,hal")
+            dataset = follow_csv(path, schema={"time": Comparisons.integers})
+            self.assertEqual(dataset.fields, ["time", "message"])
+            self.assertEqual(dataset.data, [["1", "start"]])
+
+            with open(path, "a", newline="") as csv_file:
+                csv_file.write('f\n3,"two\nlines')
+            dataset.refresh()
+            self.assertEqual(dataset.data, [["1", "start"], ["2", "half"]])
+
+            with open(path, "a", newline="") as csv_file:
+                csv_file.write('"\n')
+            dataset.refresh()
+            self.assertEqual(dataset.data, [["1", "start"], ["2", "half"], ["3", "two\nlines"]])
+            self.assertEqual(dataset.query({"time": {"gt": 1}}).count(), 2)
+
+if __name__ == "__main__":
+    unittest.main()
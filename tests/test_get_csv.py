@@ -0,0 +1,134 @@
+import asyncio, http.server, os, shutil, sys, tempfile, threading, unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import csvquery
+from csvquery import get_csv, get_csvs_async
+
+ROWS = [[str(i), "name_" + str(i), str(i * 2)] for i in range(20000)]
+
+def to_csv(rows, delimiter=","):
+    return "".join(delimiter.join(row) + "\n" for row in [["id", "name", "value"]] + rows).encode("utf-8")
+
+PAGES = {
+    "/large.csv": to_csv(ROWS),
+    "/semicolons.csv": to_csv(ROWS[:10], ";"),
+    "/cached.csv": to_csv(ROWS[:100]),
+}
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        body = PAGES.get(self.path)
+        if body == None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = '"' + str(len(body)) + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        # the body is sent in small chunks, so the client has to parse it as it arrives
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(body), 4096):
+            chunk = body[start:start + 4096]
+            self.wfile.write(("%x\r\n" % len(chunk)).encode("ascii") + chunk + b"\r\n")
+            if start == 0 and self.server.parsing != None:
+                # the rest of the body waits until the client has parsed a line of the first chunk
+                self.wfile.flush()
+                self.server.parsed_early = self.server.parsing.wait(10)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+class GetCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.server.parsing = None
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.cache = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.stop_server()
+        shutil.rmtree(self.cache)
+
+    def stop_server(self):
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def test_streamed_body(self):
+        self.server.parsing = threading.Event()
+        stream_lines = csvquery.stream_lines
+
+        def parsed_lines(*args):
+            for line in stream_lines(*args):
+                self.server.parsing.set()
+                yield line
+
+        with mock.patch.object(csvquery, "download_chunk_size", 4096), mock.patch.object(csvquery, "stream_lines", parsed_lines):
+            dataset = get_csv(self.url + "/large.csv")
+        self.assertTrue(self.server.parsed_early)
+        self.assertEqual(dataset.fields, ["id", "name", "value"])
+        self.assertEqual(dataset.data, ROWS)
+
+    def test_delimiter(self):
+        dataset = get_csv(self.url + "/semicolons.csv", delimiter=";")
+        self.assertEqual(dataset.fields, ["id", "name", "value"])
+        self.assertEqual(dataset.data, ROWS[:10])
+
+    def test_error_status(self):
+        dataset = get_csv(self.url + "/missing.csv")
+        self.assertEqual(dataset.data, [])
+
+    def test_revalidation(self):
+        first = get_csv(self.url + "/cached.csv", cache=self.cache)
+        second = get_csv(self.url + "/cached.csv", cache=self.cache)
+        self.assertEqual(first.data, ROWS[:100])
+        self.assertEqual(second.data, ROWS[:100])
+        self.assertEqual(self.server.requests, [("/cached.csv", None), ("/cached.csv", '"%d"' % len(PAGES["/cached.csv"]))])
+
+    def test_offline_fallback(self):
+        get_csv(self.url + "/cached.csv", cache=self.cache)
+        self.stop_server()
+        dataset = get_csv(self.url + "/cached.csv", cache=self.cache, timeout=5)
+        self.assertEqual(dataset.data, ROWS[:100])
+
+    def test_async(self):
+        datasets = asyncio.run(get_csvs_async([self.url + "/semicolons.csv", self.url + "/large.csv"], delimiter=";", connections=2))
+        self.assertEqual(datasets[0].data, ROWS[:10])
+        self.assertEqual(len(datasets[1].data), len(ROWS))
+
+    def test_async_sessions(self):
+        calls = []
+
+        def recorded_get_csv(url, delimiter, schema, cache, session, timeout):
+            calls.append((threading.get_ident(), session))
+            return get_csv(url, delimiter, schema, cache, session, timeout)
+
+        urls = [self.url + "/semicolons.csv"] * 8
+        with mock.patch.object(csvquery, "get_csv", recorded_get_csv):
+            datasets = asyncio.run(get_csvs_async(urls, delimiter=";", connections=4))
+        self.assertEqual([dataset.data for dataset in datasets], [ROWS[:10]] * 8)
+        sessions = dict(calls)
+        self.assertEqual(len(set(map(id, sessions.values()))), len(sessions))
+        self.assertEqual(set(calls), set(sessions.items()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import csv, os, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import csvquery
+from csvquery import open_csv, scan_csv
+
+class ParallelLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "data.csv")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, rows):
+        with open(self.path, "w", newline="", encoding="utf-8") as csv_file:
+            csv.writer(csv_file).writerows([["id", "text"]] + rows)
+
+    def test_line_breaks_inside_quotes(self):
+        # long quoted values full of line breaks, so most chunk targets fall inside one
+        self.write([[str(i), ("line\n" * (i % 40)) + 'a "quote" é'] for i in range(2000)])
+        expected = open_csv(self.path, mapped=False)
+        for parts in (2, 3, 7, 16):
+            chunks = csvquery.get_byte_chunks(self.path, parts)
+            with open(self.path, "rb") as csv_file:
+                content = csv_file.read()
+            for start, end in chunks:
+                self.assertEqual(content[:start].count(b'"') % 2, 0)
+                self.assertEqual(content[start - 1:start], b"\n")
+            self.assertEqual(chunks[-1][1], len(content))
+        dataset = open_csv(self.path, workers=4)
+        self.assertEqual(dataset.fields, expected.fields)
+        self.assertEqual(dataset.data, expected.data)
+        self.assertEqual(scan_csv(self.path).collect(workers=4).data, expected.data)
+
+    def test_file_smaller_than_workers(self):
+        self.write([["1", "a"], ["2", "b\nc"]])
+        self.assertEqual(open_csv(self.path, workers=8).data, [["1", "a"], ["2", "b\nc"]])
+
+    def test_header_only(self):
+        self.write([])
+        dataset = open_csv(self.path, workers=4)
+        self.assertEqual(dataset.fields, ["id", "text"])
+        self.assertEqual(dataset.data, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os, sys, tempfile, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from csvquery import open_csv, load_snapshot, Comparisons, IndexTypes
+
+ROWS = [["3", "c", "0.5"], ["1", "a", "2.5"], ["2", "b", "1.5"], ["1", "d", "0.1"]]
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "source.csv")
+        self.snapshot = os.path.join(self.directory.name, "source.snapshot")
+        self.write_source(ROWS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_source(self, rows):
+        with open(self.source, "w", newline="") as csv_file:
+            csv_file.write("n,name,score\n" + "".join(",".join(row) + "\n" for row in rows))
+
+    def save(self):
+        dataset = open_csv(self.source, schema={"n": Comparisons.integers, "score": Comparisons.floats})
+        dataset.index("n", Comparisons.integers)
+        dataset.add_index("score", IndexTypes.sorted, Comparisons.floats)
+        dataset.add_index("name", IndexTypes.hash)
+        dataset.save_snapshot(self.snapshot, source=self.source)
+        return dataset
+
+    def test_round_trip(self):
+        saved = self.save()
+        dataset = load_snapshot(self.snapshot, source=self.source)
+        self.assertEqual(dataset.fields, ["n", "name", "score"])
+        self.assertEqual([list(row) for row in dataset.data], saved.data)
+        self.assertIs(dataset.schema["n"], Comparisons.integers)
+        self.assertIs(dataset.schema["score"], Comparisons.floats)
+        self.assertEqual(list(dataset.typed_column("n")), [1, 1, 2, 3])
+        self.assertEqual(list(dataset.typed_column("score")), [2.5, 0.1, 1.5, 0.5])
+        self.assertEqual(dataset.indexed_field, "n")
+        self.assertEqual(list(dataset.indexes["score"].order), list(saved.indexes["score"].order))
+        self.assertEqual([list(row) for row in dataset.query({"n": 1}).data], [["1", "a", "2.5"], ["1", "d", "0.1"]])
+        self.assertEqual([list(row) for row in dataset.query({"score": {"lt": 1}}).data], [["1", "d", "0.1"], ["3", "c", "0.5"]])
+        self.assertEqual([list(row) for row in dataset.query({"name": "b"}).data], [["2", "b", "1.5"]])
+
+    def test_stale_source(self):
+        self.save()
+        first = load_snapshot(self.snapshot, source=self.source)
+        time.sleep(0.01)
+        self.write_source(ROWS + [["0", "z", "9.5"]])
+        dataset = load_snapshot(self.snapshot, source=self.source)
+        self.assertEqual(dataset.data[0], ["0", "z", "9.5"])
+        self.assertEqual(len(dataset.data), 5)
+        # the first dataset still reads the snapshot it mapped, which was replaced rather than rewritten
+        self.assertEqual(list(first.data[3]), ["3", "c", "0.5"])
+        self.assertEqual(len(load_snapshot(self.snapshot, source=self.source).data), 5)
+
+    def test_missing_source(self):
+        self.save()
+        os.remove(self.source)
+        dataset = load_snapshot(self.snapshot, source=self.source)
+        self.assertEqual(len(dataset.data), 4)
+        self.assertEqual(dataset.indexed_field, "n")
+
+if __name__ == "__main__":
+    unittest.main()